@@ -2,6 +2,8 @@ from pathlib import Path
 from datetime import timedelta
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -24,13 +26,32 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.json_codec.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.json_codec.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
+# JSON codec for REST responses/requests and WebSocket frames: "orjson" or "stdlib"
+JSON_CODEC = os.environ.get("JSON_CODEC", "orjson")
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# WebSocket handshakes reuse the user resolved for a token signature for up to this many seconds
+WS_AUTH_CACHE_TTL = 300
+WS_AUTH_CACHE_SIZE = 10000
+
+# Deletions older than this are pruned; clients with an older /sync/ cursor must reload the snapshot
+SYNC_TOMBSTONE_RETENTION = timedelta(days=30)
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -44,10 +65,12 @@ INSTALLED_APPS = [
     "channels",
     'api',
     'rest_framework',
+    'django_filters',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,25 +103,103 @@ WSGI_APPLICATION = 'ToDoListProject.wsgi.application'
 ASGI_APPLICATION = 'ToDoListProject.asgi.application'
 
 
+# Shared by the channel layer and api.redis_pool, which every other Redis call site goes through
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Upper bound of connections per pool; callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = int(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+
 CHANNEL_LAYERS = {
     'default': {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("localhost", 6379)],
+            "hosts": [REDIS_URL],
         },
     }
 }
 
+# Every open socket refreshes its presence entry this often (seconds)
+PRESENCE_HEARTBEAT_INTERVAL = 30
+# Sockets without a heartbeat for this long are reaped and their users reported offline
+PRESENCE_TIMEOUT = 90
+# Admin sockets receive presence changes batched over this many seconds
+PRESENCE_FLUSH_INTERVAL = 1
+
+# Group detail payloads are cached in Redis for this many seconds
+GROUP_CACHE_TTL = 300
+# Seconds other requests wait for the one rebuilding a missing payload
+GROUP_CACHE_LOCK_TIMEOUT = 5
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite for local runs; DATABASE_ENGINE=postgresql switches to the production profile below.
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE", "sqlite")
+
+if DATABASE_ENGINE == "postgresql":
+    # Django's native psycopg pool; it manages connection reuse itself, so CONN_MAX_AGE must stay 0
+    # when it is on. Without the pool, connections persist for POSTGRES_CONN_MAX_AGE seconds.
+    POSTGRES_POOL = os.environ.get("POSTGRES_POOL", "1") == "1"
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get("POSTGRES_DB", "todolist"),
+            'USER': os.environ.get("POSTGRES_USER", "todolist"),
+            'PASSWORD': os.environ.get("POSTGRES_PASSWORD", ""),
+            'HOST': os.environ.get("POSTGRES_HOST", "localhost"),
+            'PORT': os.environ.get("POSTGRES_PORT", "5432"),
+            'CONN_MAX_AGE': 0 if POSTGRES_POOL else int(os.environ.get("POSTGRES_CONN_MAX_AGE", 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 2)),
+                    'max_size': int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 20)),
+                    'timeout': int(os.environ.get("POSTGRES_POOL_TIMEOUT", 10)),
+                },
+            } if POSTGRES_POOL else {},
+        }
+    }
+elif DATABASE_ENGINE == "sqlite":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+        }
     }
+else:
+    raise ImproperlyConfigured(f"Unsupported DATABASE_ENGINE {DATABASE_ENGINE!r}, use 'sqlite' or 'postgresql'.")
+
+# Optional read replica; api.routers.PrimaryReplicaRouter sends safe reads to it.
+# In tests it mirrors the default database.
+if os.environ.get("DATABASE_REPLICA_HOST") and DATABASE_ENGINE == "postgresql":
+    DATABASES["replica"] = {**DATABASES["default"], "HOST": os.environ["DATABASE_REPLICA_HOST"], "TEST": {"MIRROR": "default"}}
+elif os.environ.get("SQLITE_REPLICA_PATH") and DATABASE_ENGINE == "sqlite":
+    DATABASES["replica"] = {**DATABASES["default"], "NAME": os.environ["SQLITE_REPLICA_PATH"], "TEST": {"MIRROR": "default"}}
+
+DATABASE_ROUTERS = ["api.routers.PrimaryReplicaRouter"]
+# How long a client that wrote keeps reading from the primary
+REPLICA_PIN_SECONDS = 5
+
+# Single-node deployments that stay on SQLite: WAL lets readers run alongside the writer.
+# Applied to every new SQLite connection by api.signals, see `manage.py bench_sqlite`.
+SQLITE_TUNING = os.environ.get("SQLITE_TUNING", "0") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    # negative values are KiB
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
 }
 
+# Django opens DEFERRED transactions by default; under WAL an atomic() block that reads before it
+# writes then fails with "database is locked" when upgrading its lock, whatever busy_timeout is.
+if SQLITE_TUNING:
+    for database in DATABASES.values():
+        if database["ENGINE"] == "django.db.backends.sqlite3":
+            database.setdefault("OPTIONS", {})["transaction_mode"] = "IMMEDIATE"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -118,6 +219,33 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing cost drives the size of the login tier, see `manage.py bench_hashers`.
+# "pbkdf2", "argon2" (needs argon2-cffi) and "scrypt" are production profiles;
+# "fast" is MD5 and only meant for tests and local development.
+PASSWORD_HASHER_PROFILES = {
+    "pbkdf2": "api.hashers.PBKDF2PasswordHasher",
+    "argon2": "api.hashers.Argon2PasswordHasher",
+    "scrypt": "api.hashers.ScryptPasswordHasher",
+    "fast": "django.contrib.auth.hashers.MD5PasswordHasher",
+}
+PASSWORD_HASHER_PROFILE = os.environ.get("PASSWORD_HASHER_PROFILE", "pbkdf2")
+if PASSWORD_HASHER_PROFILE not in PASSWORD_HASHER_PROFILES:
+    raise ImproperlyConfigured(
+        f"Unsupported PASSWORD_HASHER_PROFILE {PASSWORD_HASHER_PROFILE!r}, use one of {', '.join(map(repr, PASSWORD_HASHER_PROFILES))}."
+    )
+
+# The preferred hasher comes first; the other production hashers stay so existing hashes still verify
+# and get upgraded to the preferred one on the next successful login. MD5 is only accepted when selected.
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile not in (PASSWORD_HASHER_PROFILE, "fast")
+]
+
+# Unset values keep Django's defaults for the hasher
+PASSWORD_HASHER_COST = {
+    name: int(os.environ[f"PASSWORD_{name.upper()}"]) if f"PASSWORD_{name.upper()}" in os.environ else None
+    for name in ["pbkdf2_iterations", "argon2_time_cost", "argon2_memory_cost", "argon2_parallelism", "scrypt_work_factor"]
+}
+
 AUTH_USER_MODEL = "api.User"
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
@@ -6,6 +6,20 @@ from .models import User, Group, UserGroupRelation, UserTask, GroupTask
 
 admin.site.register(User)
 admin.site.register(Group)
-admin.site.register(UserGroupRelation)
-admin.site.register(UserTask)
-admin.site.register(GroupTask)
+
+
+# __str__ of these models follows foreign keys, so the changelists join them up front
+@admin.register(UserGroupRelation)
+class UserGroupRelationAdmin(admin.ModelAdmin):
+    list_select_related = ["user", "group"]
+
+
+@admin.register(UserTask)
+class UserTaskAdmin(admin.ModelAdmin):
+    list_select_related = ["user"]
+
+
+@admin.register(GroupTask)
+class GroupTaskAdmin(admin.ModelAdmin):
+    list_select_related = ["group"]
+
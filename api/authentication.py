@@ -0,0 +1,81 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.functional import cached_property
+from redis import RedisError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .redis_pool import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def revoked_key(user_id):
+    return f"auth:user:{user_id}:revoked"
+
+
+def is_revoked(user_id):
+    """Whether the user was deactivated or deleted while their access tokens are still valid.
+
+    Answers True when Redis cannot be asked, so the caller checks the database instead.
+    """
+    try:
+        return bool(get_redis().exists(revoked_key(user_id)))
+    except RedisError:
+        logger.warning("Could not read the revocation marker of user %s.", user_id, exc_info=True)
+        return True
+
+
+def set_revoked(user_id, revoked):
+    """Marks or unmarks the user's access tokens as revoked once the current transaction commits."""
+    def update():
+        try:
+            if revoked:
+                # login and token refresh refuse inactive users, so no valid token is left once the lifetime has passed
+                get_redis().set(revoked_key(user_id), 1, ex=settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"])
+            else:
+                get_redis().delete(revoked_key(user_id))
+        except RedisError:
+            logger.warning("Could not update the revocation marker of user %s.", user_id, exc_info=True)
+
+    transaction.on_commit(update)
+
+
+class ClaimsUser(TokenUser):
+    """User built from the claims CustomTokenObtainPairSerializer puts into access tokens."""
+
+    @cached_property
+    def email(self):
+        return self.token.get("email", "")
+
+    @cached_property
+    def sex(self):
+        return self.token.get("sex")
+
+    @cached_property
+    def birth_date(self):
+        return self.token.get("birth_date")
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """Opt-in authentication that skips the User query on safe (read-only) requests.
+
+    Instead of loading the user it checks the Redis revocation marker, so deactivated and deleted users
+    are still rejected. Views using it must compare users by ``request.user.id``; writes still get the full model.
+    """
+
+    def authenticate(self, request):
+        self.from_claims = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if self.from_claims and user_id is not None and not is_revoked(user_id):
+            return ClaimsUser(validated_token)
+        # the database check raises the usual errors for inactive and missing users
+        return super().get_user(validated_token)
@@ -1,61 +1,149 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+import asyncio
+import logging
+
+import msgpack
 import redis
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
 from .models import Group, GroupTask, UserGroupRelation
+from . import group_cache, json_codec, presence
+from .routers import pin_to_primary
 from .serializers import GroupTaskSerializer
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_COMMANDS = ("create", "update", "delete", "complete", "expire")
+BATCH_MAX_OPERATIONS = 500
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# group event type -> (client event name, event fields forwarded to the client)
+GROUP_EVENT_FRAMES = {
+    "group.task_created": ("task_created", ("task",)),
+    "group.task_updated": ("task_updated", ("task",)),
+    "group.task_deleted": ("task_deleted", ("task_id",)),
+    "group.task_completed": ("task_completed", ("task_id",)),
+    "group.task_expired": ("task_expired", ("task_id",)),
+    "group.tasks_expired": ("tasks_expired", ("task_ids",)),
+    "group.tasks_changed": ("tasks_changed", ("created", "updated", "deleted")),
+}
+
 
+class FrameConsumer(AsyncJsonWebsocketConsumer):
+    """JSON consumer that speaks msgpack binary frames to clients asking for the "msgpack" subprotocol."""
 
-redis_db = redis.Redis(host='localhost', port=6379, db=0)
+    use_msgpack = False
 
+    async def accept(self, subprotocol=None, headers=None):
+        if MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            self.use_msgpack = True
+            subprotocol = MSGPACK_SUBPROTOCOL
+        await super().accept(subprotocol, headers)
 
-class GroupConsumer(JsonWebsocketConsumer):
-    def connect(self):
-        self.group_id = self.scope["url_route"]["kwargs"]["group_id"]
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if self.use_msgpack and bytes_data:
+            try:
+                content = msgpack.unpackb(bytes_data)
+            except ValueError:
+                # msgpack raises ValueError subclasses for truncated, malformed or trailing data
+                await self.send_json({"error": "Invalid msgpack frame."})
+                return
+            if not isinstance(content, dict):
+                await self.send_json({"error": "Frame must be a msgpack map."})
+                return
+            await self.receive_json(content, **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.use_msgpack:
+            await self.send(bytes_data=msgpack.packb(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return json_codec.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return json_codec.dumps_text(content)
+
+
+class GroupConsumer(FrameConsumer):
+    async def connect(self):
+        self.group_id = int(self.scope["url_route"]["kwargs"]["group_id"])
         self.group_name = f"group_{self.group_id}"
 
         user = self.scope["user"]
-        self.redis_key = f"u:{user.id}"
+        self.presence_registered = False
+        self.heartbeat_task = None
 
         if user.is_authenticated:
-            async_to_sync(self.channel_layer.group_add) (
+            # joined before the lookup, so member events published while it runs are still delivered
+            await self.channel_layer.group_add(
                 self.group_name,
                 self.channel_name
             )
-            self.accept()
+            self.group_exists, self.is_member = await self.load_membership(user)
+            await self.accept()
 
-            self.send_json({
+            await self.send_json({
                 "event": f"{user.id}_{user.username}_connected"
             })
 
-            new_value = redis_db.incrby(self.redis_key, 1)
-            if new_value == 1:
-                async_to_sync(self.channel_layer.group_send)(
-                    "admin_broadcast",
-                    {
-                        "type": "admin.online_status",
-                        "user": {
-                            "id": user.id,
-                            "username": user.username,
-                        },
-                        "online": True
-                    }
-                )
-                redis_db.expire(self.redis_key, 86400)
+            came_online = await presence.user_connected(user, self.channel_name)
+            self.presence_registered = True
+            if came_online:
+                await self.announce_online(user)
+
+            self.heartbeat_task = asyncio.create_task(self.heartbeat(user))
         else:
-            self.close()
+            await self.close()
+
+    async def heartbeat(self, user):
+        # if this worker dies the heartbeats stop and the reaper reports the user offline
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                if await presence.socket_heartbeat(user, self.channel_name):
+                    await self.announce_online(user)
+            except redis.RedisError:
+                # keep beating: once Redis is back the next heartbeat registers a reaped socket again
+                logger.warning("Presence heartbeat failed for socket %s.", self.channel_name, exc_info=True)
+
+    async def announce_online(self, user):
+        await self.channel_layer.group_send(
+            "admin_broadcast",
+            {
+                "type": "admin.online_status",
+                "user": {
+                    "id": user.id,
+                    "username": user.username,
+                },
+                "online": True
+            }
+        )
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
-    def disconnect(self, code):
-        async_to_sync(self.channel_layer.group_discard) (self.group_name, self.channel_name)
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
 
-        if redis_db.exists(self.redis_key):
-            new_value = redis_db.decrby(self.redis_key, 1)
+        if self.presence_registered:
+            self.presence_registered = False
 
-            if new_value <= 0:
-                redis_db.delete(self.redis_key)
-                async_to_sync(self.channel_layer.group_send)(
+            if await presence.user_disconnected(self.scope["user"].id, self.channel_name):
+                await self.channel_layer.group_send(
                     "admin_broadcast",
                     {
                         "type": "admin.online_status",
@@ -64,222 +152,300 @@ class GroupConsumer(JsonWebsocketConsumer):
                     }
                 )
 
-    def receive_json(self, content, **kwargs):
-        user = self.scope["user"]
-        try:
-            group = Group.objects.get(id=self.group_id)
-        except ObjectDoesNotExist:
-            self.send_json({
-                "error": f"Group with id {self.group_id} does not exist."
-            })
-            return
-
-        if not UserGroupRelation.objects.filter(user=user, group=group).exists():
-            self.send_json({
-                "error": "You are not a member of this group."
-            })
-            return
-
+    async def receive_json(self, content, **kwargs):
         command = content.get("command")
         data = content.get("data", {})
 
-        if command == "create":
-            serializer = GroupTaskSerializer(data=data, context={"request": None})
+        # all ORM work for a command runs in a single hop to the database thread
+        reply, event = await self.handle_command(command, data)
 
-            if serializer.is_valid():
-                serializer.save(state=0, group=group)
-                # self.send_json({
-                #     "success": "Group task created successfully.",
-                #     "task": serializer.data
-                # })
+        if reply is not None:
+            await self.send_json(reply)
+        if event is not None:
+            await self.channel_layer.group_send(self.group_name, encode_group_event(event))
 
-                async_to_sync(self.channel_layer.group_send)(
-                    self.group_name,
-                    {
-                        "type": "group.task_created",
-                        "task": serializer.data
-                    }
-                )
-            else:
-                self.send_json({
-                    "error": "Invalid data.",
-                    "details": serializer.errors
-                })
+    @database_sync_to_async
+    def load_membership(self, user):
+        # kept for the whole connection, so it must not come from a lagging replica
+        pin_to_primary()
+        if not Group.objects.filter(id=self.group_id).exists():
+            return False, False
+        return True, UserGroupRelation.objects.filter(user=user, group_id=self.group_id).exists()
 
-        elif command == "update":
-            task_id = data["id"]
-            try:
-                task = GroupTask.objects.get(id=task_id)
-            except ObjectDoesNotExist:
-                self.send_json({"error": f"Task with id {task_id} does not exist."})
-                return
+    @database_sync_to_async
+    def handle_command(self, command, data):
+        # commands write, so their reads must not hit a lagging replica
+        pin_to_primary()
 
-            serializer = GroupTaskSerializer(task, data=data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                # self.send_json({
-                #     "success": "Task updated successfully.",
-                #     "task": serializer.data
-                # })
+        # membership is resolved once in connect() and kept fresh by group.member_* events
+        if not self.group_exists:
+            return {"error": f"Group with id {self.group_id} does not exist."}, None
 
-                async_to_sync(self.channel_layer.group_send)(
-                    self.group_name,
-                    {
-                        "type": "group.task_updated",
-                        "task": serializer.data
-                    }
-                )
-            else:
-                self.send_json({
-                    "error": "Invalid data.",
-                    "details": serializer.errors
-                })
+        if not self.is_member:
+            return {"error": "You are not a member of this group."}, None
 
+        if command == "create":
+            reply, event = self.create_task(data)
+        elif command == "update":
+            reply, event = self.update_task(data)
         elif command == "delete":
-            task_id = data
-            try:
-                task = GroupTask.objects.get(id=task_id)
-            except ObjectDoesNotExist:
-                self.send_json({"error": f"Task with id {task_id} does not exist."})
-                return
+            reply, event = self.delete_task(data)
+        elif command == "complete":
+            reply, event = self.change_task_state(data, 1, "complete", "group.task_completed")
+        elif command == "expire":
+            reply, event = self.change_task_state(data, 2, "expire", "group.task_expired")
+        elif command == "batch":
+            reply, event = self.run_batch(data)
+        else:
+            return None, None
 
-            task.delete()
+        # batches write through bulk_create/bulk_update, which skip the model signals
+        if event is not None:
+            group_cache.invalidate(self.group_id)
+        return reply, event
 
-            # self.send_json({
-            #     "success": f"Task with id {task_id} was deleted."
-            # })
+    def create_task(self, data):
+        serializer = GroupTaskSerializer(data=data, context={"request": None})
 
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
-                {
-                    "type": "group.task_deleted",
-                    "task_id": task_id
-                }
-            )
+        if not serializer.is_valid():
+            return {"error": "Invalid data.", "details": serializer.errors}, None
 
-        elif command == "complete":
-            task_id = data
-            try:
-                task = GroupTask.objects.get(id=task_id)
-            except ObjectDoesNotExist:
-                self.send_json({"error": f"Task with id {task_id} does not exist."})
-                return
+        serializer.save(state=0, group_id=self.group_id)
+        return None, {
+            "type": "group.task_created",
+            "task": serializer.data
+        }
 
-            if task.state != 0:
-                self.send_json({"error": f"Task with id {task_id} cannot be completed."})
-                return
+    def update_task(self, data):
+        task_id = data["id"]
+        try:
+            task = GroupTask.objects.get(id=task_id, group_id=self.group_id)
+        except ObjectDoesNotExist:
+            return {"error": f"Task with id {task_id} does not exist."}, None
 
-            serializer = GroupTaskSerializer(task, data={ "state": 1}, partial=True)
-            if serializer.is_valid():
-                serializer.save()
+        serializer = GroupTaskSerializer(task, data=data, partial=True)
+        if not serializer.is_valid():
+            return {"error": "Invalid data.", "details": serializer.errors}, None
 
-                # self.send_json({
-                #     "success": f"Task with id {task_id} was completed."
-                # })
+        serializer.save()
+        return None, {
+            "type": "group.task_updated",
+            "task": serializer.data
+        }
 
-                async_to_sync(self.channel_layer.group_send)(
-                    self.group_name,
-                    {
-                        "type": "group.task_completed",
-                        "task_id": task_id
-                    }
-                )
-            else:
-                self.send_json({
-                    "error": "Failed to update task state.",
-                    "details": serializer.errors
-                })
+    def delete_task(self, task_id):
+        try:
+            task = GroupTask.objects.get(id=task_id, group_id=self.group_id)
+        except ObjectDoesNotExist:
+            return {"error": f"Task with id {task_id} does not exist."}, None
 
-        elif command == "expire":
-            task_id = data
-            try:
-                task = GroupTask.objects.get(id=task_id)
-            except ObjectDoesNotExist:
-                self.send_json({"error": f"Task with id {task_id} does not exist."})
-                return
+        task.delete()
+        return None, {
+            "type": "group.task_deleted",
+            "task_id": task_id
+        }
 
-            if task.state != 0:
-                self.send_json({"error": f"Task with id {task_id} cannot be expired."})
-                return
+    def change_task_state(self, task_id, state, action, event_type):
+        try:
+            task = GroupTask.objects.get(id=task_id, group_id=self.group_id)
+        except ObjectDoesNotExist:
+            return {"error": f"Task with id {task_id} does not exist."}, None
+
+        if task.state != 0:
+            return {"error": f"Task with id {task_id} cannot be {action}d."}, None
+
+        serializer = GroupTaskSerializer(task, data={"state": state}, partial=True)
+        if not serializer.is_valid():
+            return {"error": "Failed to update task state.", "details": serializer.errors}, None
+
+        serializer.save()
+        return None, {
+            "type": event_type,
+            "task_id": task_id
+        }
+
+    @transaction.atomic
+    def run_batch(self, operations):
+        if not isinstance(operations, list) or not operations:
+            return {"error": "Batch must be a non-empty list of operations."}, None
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return {"error": f"Batch cannot contain more than {BATCH_MAX_OPERATIONS} operations."}, None
+
+        parsed = []
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict) or operation.get("command") not in BATCH_COMMANDS:
+                return batch_error(index, "Unknown command."), None
+
+            command = operation["command"]
+            data = operation.get("data", {})
+            task_id = None
+            if command != "create":
+                task_id = data.get("id") if command == "update" and isinstance(data, dict) else data
+                if not isinstance(task_id, int):
+                    return batch_error(index, "Task id must be an integer."), None
+            parsed.append((command, data, task_id))
+
+        task_ids = [task_id for _, _, task_id in parsed if task_id is not None]
+        tasks = GroupTask.objects.filter(group_id=self.group_id).select_for_update().in_bulk(task_ids)
+
+        to_create = []
+        changed = {}
+        changed_fields = set()
+        deleted = set()
+
+        # everything is validated before the first write, so an error leaves the group untouched
+        for index, (command, data, task_id) in enumerate(parsed):
+            if command == "create":
+                serializer = GroupTaskSerializer(data=data)
+                if not serializer.is_valid():
+                    return batch_error(index, "Invalid data.", serializer.errors), None
+                to_create.append(GroupTask(**{**serializer.validated_data, "state": 0}, group_id=self.group_id))
+                continue
+
+            task = tasks.get(task_id)
+            if task is None or task_id in deleted:
+                return batch_error(index, f"Task with id {task_id} does not exist."), None
+
+            if command == "delete":
+                deleted.add(task_id)
+                changed.pop(task_id, None)
+                continue
+
+            if command == "update":
+                serializer = GroupTaskSerializer(task, data=data, partial=True)
+                if not serializer.is_valid():
+                    return batch_error(index, "Invalid data.", serializer.errors), None
+                values = serializer.validated_data
+            else:
+                if task.state != 0:
+                    return batch_error(index, f"Task with id {task_id} cannot be {command}d."), None
+                values = {"state": 1 if command == "complete" else 2}
+
+            for field, value in values.items():
+                setattr(task, field, value)
+            changed_fields.update(values)
+            changed[task_id] = task
+
+        created = GroupTask.objects.bulk_create(to_create)
+        if changed:
+            # bulk_update bypasses auto_now, so updated_at is set by hand for /sync/
+            now = timezone.now()
+            for task in changed.values():
+                task.updated_at = now
+            GroupTask.objects.bulk_update(changed.values(), sorted(changed_fields | {"updated_at"}))
+        if deleted:
+            GroupTask.objects.filter(id__in=deleted).delete()
+
+        return None, {
+            "type": "group.tasks_changed",
+            "created": GroupTaskSerializer(created, many=True).data,
+            "updated": GroupTaskSerializer(changed.values(), many=True).data,
+            "deleted": sorted(deleted)
+        }
+
+    async def group_member_added(self, event):
+        if event["user_id"] == self.scope["user"].id:
+            self.is_member = True
+
+    async def group_member_removed(self, event):
+        if event["user_id"] == self.scope["user"].id:
+            self.is_member = False
+
+    async def group_deleted(self, event):
+        self.group_exists = False
+        self.is_member = False
+
+    async def send_group_event(self, event):
+        # events from encode_group_event() carry the frame already encoded for every subscriber
+        if self.use_msgpack and "msgpack" in event:
+            await self.send(bytes_data=event["msgpack"])
+        elif not self.use_msgpack and "text" in event:
+            await self.send(text_data=event["text"])
+        else:
+            await self.send_json(client_frame(event))
 
-            serializer = GroupTaskSerializer(task, data={ "state": 2}, partial=True)
-            if serializer.is_valid():
-                serializer.save()
+    group_task_created = send_group_event
+    group_task_updated = send_group_event
+    group_task_deleted = send_group_event
+    group_task_completed = send_group_event
+    group_task_expired = send_group_event
+    group_tasks_expired = send_group_event
+    group_tasks_changed = send_group_event
 
-                # self.send_json({
-                #     "success": f"Task with id {task_id} was expired."
-                # })
 
-                async_to_sync(self.channel_layer.group_send)(
-                    self.group_name,
-                    {
-                        "type": "group.task_expired",
-                        "task_id": task_id
-                    }
-                )
-            else:
-                self.send_json({
-                    "error": "Failed to update task state.",
-                    "details": serializer.errors
-                })
-
-    def group_task_created(self, event):
-        self.send_json({
-            "event": "task_created",
-            "task": event["task"]
-        })
+def client_frame(event):
+    name, fields = GROUP_EVENT_FRAMES[event["type"]]
+    return {"event": name, **{field: event[field] for field in fields}}
 
-    def group_task_updated(self, event):
-        self.send_json({
-            "event": "task_updated",
-            "task": event["task"]
-        })
 
-    def group_task_deleted(self, event):
-        self.send_json({
-            "event": "task_deleted",
-            "task_id": event["task_id"]
-        })
+def encode_group_event(event):
+    """Adds the client frame of a group event as JSON text and msgpack, so it is encoded once instead of once per subscriber."""
+    frame = client_frame(event)
+    return {**event, "text": json_codec.dumps_text(frame), "msgpack": msgpack.packb(frame)}
 
-    def group_task_completed(self, event):
-        self.send_json({
-            "event": "task_completed",
-            "task_id": event["task_id"]
-        })
 
-    def group_task_expired(self, event):
-        self.send_json({
-            "event": "task_expired",
-            "task_id": event["task_id"]
-        })
+def batch_error(index, message, details=None):
+    error = {"error": message, "index": index}
+    if details is not None:
+        error["details"] = details
+    return error
+
 
+class AdminConsumer(FrameConsumer):
+    async def connect(self):
+        self.users_in = {}
+        self.users_out = set()
+        self.flush_task = None
 
-class AdminConsumer(JsonWebsocketConsumer):
-    def connect(self):
         if self.scope["user"].is_authenticated and self.scope["user"].is_staff:
-            async_to_sync(self.channel_layer.group_add)(
+            # join before reading the snapshot so changes made while it is read end up in the next diff
+            await self.channel_layer.group_add(
                 "admin_broadcast",
                 self.channel_name
             )
-            self.accept()
+            await self.accept()
+
+            await self.send_json({
+                "event": "online_snapshot",
+                "users": await presence.all_online_users()
+            })
+            self.flush_task = asyncio.create_task(self.flush_periodically())
         else:
-            self.close()
+            await self.close()
+
+    async def disconnect(self, code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
 
-    def disconnect(self, code):
-        async_to_sync(self.channel_layer.group_discard)(
+        await self.channel_layer.group_discard(
             "admin_broadcast",
             self.channel_name
         )
 
-    def admin_online_status(self, event):
+    async def admin_online_status(self, event):
+        # only the latest change per user within a flush interval is kept
         if event["online"]:
-            message = {
-                "event": "user_in",
-                "user": event["user"],
-            }
+            user = event["user"]
+            self.users_out.discard(user["id"])
+            self.users_in[user["id"]] = user
         else:
-            message = {
-                "event": "user_out",
-                "id": event["id"],
-            }
-        self.send_json(message)
\ No newline at end of file
+            self.users_in.pop(event["id"], None)
+            self.users_out.add(event["id"])
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if not self.users_in and not self.users_out:
+            return
+
+        users_in, self.users_in = self.users_in, {}
+        users_out, self.users_out = self.users_out, set()
+        await self.send_json({
+            "event": "presence_diff",
+            "users_in": list(users_in.values()),
+            "users_out": sorted(users_out)
+        })
@@ -0,0 +1,21 @@
+from django_filters import rest_framework as filters
+
+from .models import UserTask, GroupTask
+
+
+class UserTaskFilter(filters.FilterSet):
+    class Meta:
+        model = UserTask
+        fields = {
+            "state": ["exact"],
+            "deadline": ["gte", "lte"],
+        }
+
+
+class GroupTaskFilter(filters.FilterSet):
+    class Meta:
+        model = GroupTask
+        fields = {
+            "state": ["exact"],
+            "deadline": ["gte", "lte"],
+        }
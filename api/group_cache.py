@@ -0,0 +1,116 @@
+import logging
+import time
+
+import msgpack
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .redis_pool import get_redis, pipeline
+from .routers import pin_to_primary
+
+
+logger = logging.getLogger(__name__)
+
+# how often a caller waiting for another one's rebuild checks for the payload
+LOCK_POLL_INTERVAL = 0.05
+
+
+def version_key(group_id):
+    return f"group:{group_id}:version"
+
+
+def payload_key(group_id, version):
+    return f"group:{group_id}:detail:{version}"
+
+
+def get_group_detail(group_id, build):
+    """Returns the GroupDetailSerializer payload of a group, calling build() on a cache miss.
+
+    Payloads are stored per group version, so invalidating only bumps the version.
+    A single caller rebuilds a missing version while the others wait for its result.
+    """
+    client = get_redis()
+    locked = False
+    try:
+        # the version is read before the primary, so a payload built from stale rows is never stored under a newer version
+        version = int(client.get(version_key(group_id)) or 0)
+        key = payload_key(group_id, version)
+        lock = f"{key}:lock"
+        blob = client.get(key)
+        if blob is None:
+            locked = client.set(lock, 1, nx=True, px=int(settings.GROUP_CACHE_LOCK_TIMEOUT * 1000))
+            if not locked:
+                blob = wait_for_payload(client, key)
+    except redis.RedisError:
+        logger.warning("Group detail cache unavailable, serving group %s from the database.", group_id, exc_info=True)
+        return build()
+
+    if blob is not None:
+        return msgpack.unpackb(blob)
+
+    try:
+        # a replica can lag behind the version read above
+        pin_to_primary()
+        payload = build()
+        try:
+            client.set(key, msgpack.packb(payload), ex=settings.GROUP_CACHE_TTL)
+        except redis.RedisError:
+            logger.warning("Could not cache the detail payload of group %s.", group_id, exc_info=True)
+        return payload
+    finally:
+        if locked:
+            try:
+                client.delete(lock)
+            except redis.RedisError:
+                pass
+
+
+def wait_for_payload(client, key):
+    deadline = time.monotonic() + settings.GROUP_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        blob = client.get(key)
+        if blob is not None:
+            return blob
+    # the rebuilding caller died or is too slow, so this one builds the payload itself
+    return None
+
+
+class PendingInvalidation:
+    """on_commit callback that bumps every group invalidated within one transaction together."""
+
+    def __init__(self, group_ids):
+        self.group_ids = set(group_ids)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        bump_versions(self.group_ids)
+
+
+def invalidate(*group_ids):
+    """Drops the cached detail payloads of the groups once the current transaction commits."""
+    if not group_ids:
+        return
+
+    connection = transaction.get_connection()
+    pending = getattr(connection, "pending_group_invalidation", None)
+    # a rolled back savepoint drops its callbacks, so a pending set is only reused while its callback is still queued
+    if pending is not None and not pending.done and any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending.group_ids.update(group_ids)
+        return
+
+    pending = connection.pending_group_invalidation = PendingInvalidation(group_ids)
+    transaction.on_commit(pending)
+
+
+def bump_versions(group_ids):
+    try:
+        with pipeline(transaction=False) as pipe:
+            for group_id in group_ids:
+                pipe.incr(version_key(group_id))
+            pipe.execute()
+    except redis.RedisError:
+        # stale payloads still expire after GROUP_CACHE_TTL
+        logger.warning("Could not invalidate the detail cache of groups %s.", sorted(group_ids), exc_info=True)
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+# Same algorithm names as Django's hashers, so stored hashes keep verifying. When a cost below
+# changes, must_update() notices and Django rehashes the password on the user's next login.
+
+def cost(name, default):
+    value = settings.PASSWORD_HASHER_COST.get(name)
+    return default if value is None else value
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return cost("pbkdf2_iterations", hashers.PBKDF2PasswordHasher.iterations)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return cost("argon2_time_cost", hashers.Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return cost("argon2_memory_cost", hashers.Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return cost("argon2_parallelism", hashers.Argon2PasswordHasher.parallelism)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return cost("scrypt_work_factor", hashers.ScryptPasswordHasher.work_factor)
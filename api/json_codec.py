@@ -0,0 +1,57 @@
+import json
+
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# DRF's encoder, so both codecs write what DRF's own JSONRenderer wrote before
+_encoder = JSONEncoder()
+
+# JSON_CODEC = "stdlib" (or orjson not being installed) falls back to the json module
+use_orjson = orjson is not None and settings.JSON_CODEC == "orjson"
+
+if use_orjson:
+    # datetimes go to the DRF encoder, which writes UTC as "Z" like DRF did before
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(data):
+        # orjson handles UUIDs itself, the DRF encoder covers datetimes, Decimal, lazy strings, ...
+        return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(data):
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+def dumps_text(data):
+    return dumps(data).decode()
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # indented output (e.g. for the browsable API) keeps DRF's own encoder
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class JSONParser(parsers.JSONParser):
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
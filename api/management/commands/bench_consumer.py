@@ -0,0 +1,137 @@
+import asyncio
+import statistics
+import subprocess
+import time
+import types
+import uuid
+from datetime import date, timedelta
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import re_path
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.models import User, Group, UserGroupRelation
+
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 100000},
+    }
+}
+
+
+def load_consumer_at(revision):
+    """GroupConsumer from api/consumers.py as it was at a git revision, importing today's models and serializers."""
+    try:
+        source = subprocess.run(
+            ["git", "show", f"{revision}:api/consumers.py"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise CommandError(f"Cannot read api/consumers.py at {revision}: {getattr(exc, 'stderr', '') or exc}")
+
+    module = types.ModuleType(f"api.consumers@{revision}")
+    # the old module's relative imports resolve against the api package
+    module.__package__ = "api"
+    exec(compile(source, f"{revision}:api/consumers.py", "exec"), module.__dict__)
+    return module.GroupConsumer
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a group WebSocket consumer: N clients in one group each send M 'create' commands "
+        "and wait for their own broadcast. Reports messages/sec and latency percentiles. "
+        "Pass --revision with a commit from before the async rewrite to benchmark that revision's consumer instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", default="api.consumers.GroupConsumer")
+        parser.add_argument("--revision", help="Benchmark the GroupConsumer of api/consumers.py at this git revision.")
+        parser.add_argument("--clients", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if options["revision"]:
+            consumer = load_consumer_at(options["revision"])
+            options["consumer"] = f"GroupConsumer at {options['revision']}"
+        else:
+            consumer = import_string(options["consumer"])
+        clients = options["clients"]
+        messages = options["messages"]
+
+        user = User.objects.create_user(
+            email=f"bench-{uuid.uuid4().hex}@example.com",
+            username="bench",
+            password=None,
+            sex=True,
+            birth_date=date(2000, 1, 1),
+        )
+        group = Group.objects.create(name="bench")
+        UserGroupRelation.objects.create(user=user, group=group)
+
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                latencies, elapsed = asyncio.run(self.run(consumer, user, group, clients, messages))
+        finally:
+            group.delete()
+            user.delete()
+
+        latencies.sort()
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(f"consumer:     {options['consumer']}")
+        self.stdout.write(f"clients:      {clients} x {messages} messages")
+        self.stdout.write(f"messages/sec: {len(latencies) / elapsed:.1f}")
+        self.stdout.write(f"p50:          {percentiles[49] * 1000:.2f} ms")
+        self.stdout.write(f"p99:          {percentiles[98] * 1000:.2f} ms")
+
+    async def run(self, consumer, user, group, clients, messages):
+        application = URLRouter([
+            re_path(r"ws/groups/(?P<group_id>\d+)/$", consumer.as_asgi()),
+        ])
+
+        communicators = []
+        for _ in range(clients):
+            communicator = WebsocketCommunicator(application, f"/ws/groups/{group.id}/")
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError("Consumer rejected the benchmark connection.")
+            await communicator.receive_json_from()
+            communicators.append(communicator)
+
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.run_client(communicator, index, messages, latencies)
+            for index, communicator in enumerate(communicators)
+        ))
+        elapsed = time.perf_counter() - started
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        return latencies, elapsed
+
+    async def run_client(self, communicator, index, messages, latencies):
+        deadline = (timezone.now() + timedelta(days=1)).isoformat()
+
+        for n in range(messages):
+            name = f"bench-{index}-{n}"
+            sent = time.perf_counter()
+            await communicator.send_json_to({
+                "command": "create",
+                "data": {"name": name, "deadline": deadline},
+            })
+
+            # drain broadcasts caused by other clients until our own task comes back
+            while True:
+                message = await communicator.receive_json_from(timeout=30)
+                if message.get("task", {}).get("name") == name:
+                    break
+            latencies.append(time.perf_counter() - sent)
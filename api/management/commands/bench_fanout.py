@@ -0,0 +1,62 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.consumers import GroupConsumer, encode_group_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU cost of delivering one group broadcast to N subscribed GroupConsumers, "
+        "encoding the frame per socket versus once per event (encode_group_event). "
+        "Sockets are not opened; each consumer's send is a no-op, so only handler and encoding work is timed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, nargs="+", default=[10, 100, 1000, 10000])
+        parser.add_argument("--events", type=int, default=20)
+
+    def handle(self, *args, **options):
+        event = {
+            "type": "group.task_created",
+            "task": {
+                "id": 1,
+                "name": "Write the quarterly report",
+                "description": "Collect the numbers from every team and summarize them.",
+                "deadline": (timezone.now() + timedelta(days=1)).isoformat(),
+                "state": 0,
+                "group": 1,
+            },
+        }
+
+        self.stdout.write(f"{'subscribers':>11}  {'protocol':>8}  {'per socket':>14}  {'encode once':>14}")
+        for subscribers in options["subscribers"]:
+            for protocol in ("json", "msgpack"):
+                per_socket = asyncio.run(self.measure(event, subscribers, protocol, options["events"], False))
+                encode_once = asyncio.run(self.measure(event, subscribers, protocol, options["events"], True))
+                self.stdout.write(
+                    f"{subscribers:>11}  {protocol:>8}  {per_socket * 1000:>11.3f} ms  {encode_once * 1000:>11.3f} ms"
+                )
+        self.stdout.write("times are CPU time per event, including encode_group_event() for 'encode once'")
+
+    async def measure(self, event, subscribers, protocol, events, pre_encode):
+        async def discard(message):
+            pass
+
+        consumers = []
+        for _ in range(subscribers):
+            consumer = GroupConsumer()
+            consumer.base_send = discard
+            consumer.use_msgpack = protocol == "msgpack"
+            consumers.append(consumer)
+
+        started = time.process_time()
+        for _ in range(events):
+            # the channel layer hands every subscriber the same event
+            delivered = encode_group_event(event) if pre_encode else event
+            for consumer in consumers:
+                await consumer.group_task_created(delivered)
+        return (time.process_time() - started) / events
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    help = (
+        "Report password hashes/sec on one core for every PASSWORD_HASHER_PROFILES entry "
+        "at the configured PASSWORD_HASHER_COST, to size the login tier."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=3.0, help="Time spent measuring each hasher.")
+
+    def handle(self, *args, **options):
+        for profile, path in settings.PASSWORD_HASHER_PROFILES.items():
+            hasher = import_string(path)()
+            try:
+                encoded = hasher.encode("benchmark-password", hasher.salt())
+            except ValueError as e:
+                # raised by hashers whose optional library (e.g. argon2-cffi) is not installed
+                self.stdout.write(f"{profile:<8} unavailable: {e}")
+                continue
+
+            hashes = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < options["seconds"]:
+                hasher.verify("benchmark-password", encoded)
+                hashes += 1
+            elapsed = time.perf_counter() - started
+
+            marker = " (active)" if profile == settings.PASSWORD_HASHER_PROFILE else ""
+            self.stdout.write(f"{profile:<8} {hashes / elapsed:10.1f} hashes/sec{marker}")
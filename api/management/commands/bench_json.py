@@ -0,0 +1,67 @@
+import json
+import time
+import uuid
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api import json_codec
+from api.models import User, UserTask
+from api.views import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long it takes to encode and decode the LoginView snapshot of a user with many tasks, "
+        "with DRF's stock JSONRenderer / json.loads versus api.json_codec (JSON_CODEC setting)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=10000)
+        parser.add_argument("--rounds", type=int, default=10)
+
+    def handle(self, *args, **options):
+        rounds = options["rounds"]
+        user = User.objects.create_user(
+            email=f"bench-{uuid.uuid4().hex}@example.com",
+            username="bench",
+            password=None,
+            sex=True,
+            birth_date=date(2000, 1, 1),
+        )
+        now = timezone.now()
+        UserTask.objects.bulk_create(
+            UserTask(user=user, name=f"task {n}", description="benchmark task", deadline=now + timedelta(minutes=n))
+            for n in range(options["tasks"])
+        )
+
+        try:
+            started = time.perf_counter()
+            payload = build_snapshot(user)
+            snapshot_time = time.perf_counter() - started
+        finally:
+            user.delete()
+
+        stock_renderer = JSONRenderer()
+        body = stock_renderer.render(payload)
+        timings = {
+            "render, DRF JSONRenderer": self.measure(lambda: stock_renderer.render(payload), rounds),
+            "render, json_codec": self.measure(lambda: json_codec.dumps(payload), rounds),
+            "parse, json.loads": self.measure(lambda: json.loads(body), rounds),
+            "parse, json_codec": self.measure(lambda: json_codec.loads(body), rounds),
+        }
+
+        self.stdout.write(f"codec:                      {'orjson' if json_codec.use_orjson else 'stdlib'}")
+        self.stdout.write(f"tasks:                      {options['tasks']}")
+        self.stdout.write(f"payload size:               {len(body) / 1024:.1f} KiB")
+        self.stdout.write(f"snapshot (ORM + DRF):       {snapshot_time * 1000:.2f} ms")
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name + ':':<28}{seconds * 1000:.2f} ms")
+
+    def measure(self, function, rounds):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            function()
+        return (time.perf_counter() - started) / rounds
@@ -0,0 +1,58 @@
+import time
+import uuid
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure logins/sec of POST /api/login/ in a single thread (i.e. per core) "
+        "and how many password hash checks each login performs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=50)
+
+    def handle(self, *args, **options):
+        logins = options["logins"]
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(
+            email=f"bench-{uuid.uuid4().hex}@example.com",
+            username="bench",
+            password=password,
+            sex=True,
+            birth_date=date(2000, 1, 1),
+        )
+
+        checks = 0
+        check_password = AbstractBaseUser.check_password
+
+        def counting_check_password(self, raw_password):
+            nonlocal checks
+            checks += 1
+            return check_password(self, raw_password)
+
+        client = APIClient()
+        credentials = {"email": user.email, "password": password}
+        try:
+            with override_settings(ALLOWED_HOSTS=["*"]), \
+                    mock.patch.object(AbstractBaseUser, "check_password", counting_check_password):
+                started = time.perf_counter()
+                for _ in range(logins):
+                    response = client.post("/api/login/", credentials, format="json")
+                    if response.status_code != 200:
+                        raise RuntimeError(f"Login failed with status {response.status_code}.")
+                elapsed = time.perf_counter() - started
+        finally:
+            user.delete()
+
+        self.stdout.write(f"logins:               {logins}")
+        self.stdout.write(f"hash checks / login:  {checks / logins:.1f}")
+        self.stdout.write(f"logins/sec per core:  {logins / elapsed:.1f}")
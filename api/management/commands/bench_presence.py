@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import presence
+from api.redis_pool import get_async_redis
+
+
+# far above real user ids so the benchmark never touches live presence entries
+BENCH_USER_ID_OFFSET = 10 ** 12
+
+
+class BenchUser:
+    def __init__(self, n):
+        self.id = BENCH_USER_ID_OFFSET + n
+        self.username = f"bench{n}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark presence connect/disconnect against the configured Redis: "
+        "compares the previous per-command sequence with the single-script path "
+        "and reports Redis round trips and throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--sockets", type=int, default=3, help="Sockets opened per user.")
+        parser.add_argument("--concurrency", type=int, default=100)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options["users"], options["sockets"], options["concurrency"]))
+
+    async def run(self, users, sockets, concurrency):
+        client = get_async_redis()
+        stats = client.connection_pool.stats
+        # warm the pool and load the scripts so neither is counted
+        await self.scripted_cycle(BenchUser(-1), "warmup")
+
+        for name, cycle in [("per-command", self.legacy_cycle), ("lua script", self.scripted_cycle)]:
+            semaphore = asyncio.Semaphore(concurrency)
+            checkouts = stats.checkouts
+
+            async def run_socket(user, n):
+                async with semaphore:
+                    await cycle(user, f"bench.{user.id}.{n}")
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_socket(BenchUser(u), n) for u in range(users) for n in range(sockets)
+            ))
+            elapsed = time.perf_counter() - started
+
+            cycles = users * sockets
+            self.stdout.write(f"== {name}")
+            self.stdout.write(f"round trips per connect+disconnect: {(stats.checkouts - checkouts) / cycles:.2f}")
+            self.stdout.write(f"connect+disconnect/sec:             {cycles / elapsed:.0f}")
+
+    async def legacy_cycle(self, user, channel_name):
+        # the sequence GroupConsumer used before presence moved to Lua scripts
+        client = get_async_redis()
+        key = f"bench:u:{user.id}"
+
+        if await client.incrby(key, 1) == 1:
+            await client.expire(key, 86400)
+
+        if await client.exists(key):
+            if await client.decrby(key, 1) <= 0:
+                await client.delete(key)
+
+    async def scripted_cycle(self, user, channel_name):
+        await presence.user_connected(user, channel_name)
+        await presence.user_disconnected(user.id, channel_name)
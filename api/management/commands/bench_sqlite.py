@@ -0,0 +1,124 @@
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api.models import Group, GroupTask
+
+
+# SQLITE_TUNING applies the pragmas through api.signals, transaction_mode is what settings.py sets with it
+MODES = {
+    "default": (False, {}),
+    "wal, deferred transactions": (True, {}),
+    "tuned": (True, {"transaction_mode": "IMMEDIATE"}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare SQLite read/write concurrency through Django connections with default journaling, "
+        "with SQLITE_PRAGMAS alone and with SQLITE_PRAGMAS plus IMMEDIATE transactions (SQLITE_TUNING=1): "
+        "reader threads run the group task listing while writer threads run consumer-style atomic read-then-update blocks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--tasks", type=int, default=100000)
+        parser.add_argument("--groups", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for mode, (tuning, database_options) in MODES.items():
+            with tempfile.TemporaryDirectory() as directory, override_settings(SQLITE_TUNING=tuning):
+                alias = "bench_sqlite"
+                connections.settings[alias] = connections.configure_settings({**connections.settings, alias: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": os.path.join(directory, "bench.sqlite3"),
+                    "OPTIONS": database_options,
+                }})[alias]
+                try:
+                    seeded = self.seed(alias, options["tasks"], options["groups"])
+                    reads, writes, failed, elapsed = self.run(alias, seeded, options)
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    del connections.settings[alias]
+
+            self.stdout.write(f"== {mode}")
+            self.stdout.write(f"reads/sec:     {len(reads) / elapsed:.0f}")
+            self.stdout.write(f"writes/sec:    {len(writes) / elapsed:.0f}")
+            self.stdout.write(f"failed writes: {failed}")
+            self.stdout.write(f"read p99:      {self.p99(reads):.2f} ms")
+            self.stdout.write(f"write p99:     {self.p99(writes):.2f} ms")
+
+    def p99(self, latencies):
+        if len(latencies) < 2:
+            return float("nan")
+        return statistics.quantiles(sorted(latencies), n=100)[98] * 1000
+
+    def seed(self, alias, tasks, groups):
+        with connections[alias].schema_editor() as editor:
+            editor.create_model(Group)
+            editor.create_model(GroupTask)
+
+        now = timezone.now()
+        group_ids = [group.id for group in Group.objects.using(alias).bulk_create(Group(name=f"group {n}") for n in range(groups))]
+        GroupTask.objects.using(alias).bulk_create(
+            (
+                GroupTask(name=f"task {n}", deadline=now + timedelta(minutes=n % 10000), group_id=group_ids[n % groups])
+                for n in range(tasks)
+            ),
+            batch_size=5000,
+        )
+        return list(GroupTask.objects.using(alias).values_list("id", flat=True)), group_ids
+
+    def run(self, alias, seeded, options):
+        task_ids, group_ids = seeded
+        stop = threading.Event()
+        reads, writes = [], []
+        failed = 0
+
+        def reader():
+            # the group task page served by GroupTaskListCreateView
+            while not stop.is_set():
+                started = time.perf_counter()
+                list(GroupTask.objects.using(alias).filter(group_id=random.choice(group_ids)).order_by("deadline", "id")[:50])
+                reads.append(time.perf_counter() - started)
+            connections[alias].close()
+
+        def writer():
+            nonlocal failed
+            # like GroupConsumer commands: read the task, then write it, in one transaction
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic(using=alias):
+                        task = GroupTask.objects.using(alias).only("id", "state").get(id=random.choice(task_ids))
+                        GroupTask.objects.using(alias).filter(id=task.id).update(state=(task.state + 1) % 3, updated_at=timezone.now())
+                except OperationalError:
+                    failed += 1
+                    continue
+                writes.append(time.perf_counter() - started)
+            connections[alias].close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        threads += [threading.Thread(target=writer) for _ in range(options["writers"])]
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options["seconds"])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return reads, writes, failed, time.perf_counter() - started
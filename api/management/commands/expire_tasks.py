@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.scheduler import DeadlineScheduler
+
+
+class Command(BaseCommand):
+    help = "Expire user and group tasks whose deadline has passed and notify connected group members."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--refresh-interval", type=int, default=60,
+                            help="Seconds of upcoming deadlines loaded into the scheduler at a time.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Maximum number of deadlines loaded per model on each refresh.")
+        parser.add_argument("--once", action="store_true",
+                            help="Expire everything that is currently overdue and exit.")
+
+    def handle(self, *args, **options):
+        scheduler = DeadlineScheduler(options["refresh_interval"], options["batch_size"])
+
+        if options["once"]:
+            total = scheduler.tick()
+            # a full batch of overdue tasks moves next_refresh into the past, so keep draining
+            while scheduler.next_refresh <= timezone.now():
+                total += scheduler.tick()
+            self.stdout.write(f"Expired {total} tasks.")
+            return
+
+        self.stdout.write("Task expiry scheduler started.")
+        scheduler.run_forever()
@@ -0,0 +1,96 @@
+import random
+import re
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import User, Group, UserGroupRelation, UserTask, GroupTask
+
+
+SEED_EMAIL_DOMAIN = "explain-seed.invalid"
+
+# SQLite: "SEARCH ... USING INDEX", PostgreSQL: "Index Scan", "Index Only Scan", "Bitmap Index Scan"
+INDEX_SCAN = re.compile(r"USING (COVERING )?INDEX|Index (Only )?Scan", re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the EXPLAIN plan of every hot task query and whether it is served by an index. "
+        "Use --seed to first fill the database with generated users, groups and tasks "
+        "(e.g. --seed 1000000); never run --seed against production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Number of tasks to generate before explaining.")
+        parser.add_argument("--owners", type=int, default=1000, help="Number of seeded users and groups.")
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["seed"], options["owners"], options["batch_size"])
+
+        user = User.objects.filter(tasks__isnull=False).first()
+        group = Group.objects.filter(tasks__isnull=False).first()
+        if user is None or group is None:
+            self.stderr.write("No user and group tasks to explain, run with --seed first.")
+            return
+
+        now = timezone.now()
+        queries = {
+            "user tasks page": UserTask.objects.filter(user=user).order_by("deadline", "id")[:50],
+            "user tasks by state": UserTask.objects.filter(user=user, state=0).order_by("deadline", "id")[:50],
+            "user sync": UserTask.objects.filter(user=user, updated_at__gt=now - timedelta(hours=1)),
+            "group tasks page": GroupTask.objects.filter(group=group).order_by("deadline", "id")[:50],
+            "group tasks by state": GroupTask.objects.filter(group=group, state=0).order_by("deadline", "id")[:50],
+            "group sync": GroupTask.objects.filter(group=group, updated_at__gt=now - timedelta(hours=1)),
+            "user task expiry": UserTask.objects.filter(state=0, deadline__lte=now).order_by("deadline")[:1000],
+            "group task expiry": GroupTask.objects.filter(state=0, deadline__lte=now).order_by("deadline")[:1000],
+        }
+
+        for name, queryset in queries.items():
+            plan = queryset.explain()
+            started = time.perf_counter()
+            list(queryset.values_list("id", flat=True))
+            elapsed = time.perf_counter() - started
+
+            status = "index scan" if INDEX_SCAN.search(plan) else "NO INDEX"
+            self.stdout.write(f"== {name}: {status}, {elapsed * 1000:.2f} ms")
+            self.stdout.write(plan)
+            self.stdout.write("")
+
+    def seed(self, count, owners, batch_size):
+        birth_date = date(2000, 1, 1)
+        users = User.objects.bulk_create([
+            User(email=f"seed{n}-{time.time_ns()}@{SEED_EMAIL_DOMAIN}", username=f"seed{n}",
+                 password="!", sex=True, birth_date=birth_date)
+            for n in range(owners)
+        ], batch_size=batch_size)
+        groups = Group.objects.bulk_create([Group(name=f"seed{n}") for n in range(owners)], batch_size=batch_size)
+        UserGroupRelation.objects.bulk_create(
+            [UserGroupRelation(user=user, group=group) for user, group in zip(users, groups)],
+            batch_size=batch_size
+        )
+
+        now = timezone.now()
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            tasks = []
+            for n in range(size):
+                deadline = now + timedelta(minutes=random.randint(-60 * 24 * 30, 60 * 24 * 365))
+                state = random.choices((0, 1, 2), weights=(2, 7, 1))[0]
+                # alternate between user and group tasks so both tables get half of the rows
+                if (created + n) % 2:
+                    tasks.append(UserTask(name="seed", deadline=deadline, state=state, user=random.choice(users)))
+                else:
+                    tasks.append(GroupTask(name="seed", deadline=deadline, state=state, group=random.choice(groups)))
+            UserTask.objects.bulk_create([task for task in tasks if isinstance(task, UserTask)])
+            GroupTask.objects.bulk_create([task for task in tasks if isinstance(task, GroupTask)])
+            created += size
+            self.stdout.write(f"Seeded {created}/{count} tasks.")
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import DeletedTask
+
+
+class Command(BaseCommand):
+    help = "Delete task tombstones older than SYNC_TOMBSTONE_RETENTION."
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - settings.SYNC_TOMBSTONE_RETENTION
+        deleted, _ = DeletedTask.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(f"Pruned {deleted} tombstones.")
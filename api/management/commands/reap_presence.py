@@ -0,0 +1,50 @@
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import presence
+
+
+class Command(BaseCommand):
+    help = "Remove sockets that stopped sending presence heartbeats and report their users offline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Maximum number of sockets removed per Redis call.")
+        parser.add_argument("--interval", type=int, default=None,
+                            help="Seconds between sweeps, defaults to PRESENCE_HEARTBEAT_INTERVAL.")
+        parser.add_argument("--once", action="store_true", help="Run a single sweep and exit.")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] or settings.PRESENCE_HEARTBEAT_INTERVAL
+
+        while True:
+            reaped = self.sweep(options["batch_size"])
+            if options["once"]:
+                self.stdout.write(f"Reaped {reaped} sockets.")
+                return
+            time.sleep(interval)
+
+    def sweep(self, batch_size):
+        channel_layer = get_channel_layer()
+        total = 0
+
+        while True:
+            reaped, offline = presence.reap_sockets(batch_size)
+            total += reaped
+
+            for user_id in offline:
+                async_to_sync(channel_layer.group_send)(
+                    "admin_broadcast",
+                    {
+                        "type": "admin.online_status",
+                        "id": user_id,
+                        "online": False
+                    }
+                )
+
+            if reaped < batch_size:
+                return total
@@ -1,3 +1,7 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from urllib.parse import parse_qs
 
 from channels.auth import AuthMiddlewareStack
@@ -5,13 +9,114 @@ from channels.db import database_sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from django.db import close_old_connections
+from django.db import close_old_connections, transaction
+from rest_framework.permissions import SAFE_METHODS
 
 from jwt import decode as jwt_decode, InvalidSignatureError, ExpiredSignatureError, DecodeError
+from redis import RedisError
 
+from .redis_pool import get_async_redis, get_redis
+from .routers import pinned_to_primary
+
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+
+def auth_version_key(user_id):
+    return f"auth:user:{user_id}:version"
+
+
+async def get_auth_version(user_id):
+    """Current auth version of a user, or None when Redis cannot be asked."""
+    try:
+        return int(await get_async_redis().get(auth_version_key(user_id)) or 0)
+    except RedisError:
+        logger.warning("Could not read the auth version of user %s.", user_id, exc_info=True)
+        return None
+
+
+def bump_auth_version(user_id):
+    """Makes every worker drop its cached copies of the user once the current transaction commits."""
+    def bump():
+        try:
+            get_redis().incr(auth_version_key(user_id))
+        except RedisError:
+            logger.warning("Could not invalidate cached tokens of user %s.", user_id, exc_info=True)
+
+    transaction.on_commit(bump)
+
+
+class TokenUserCache:
+    """Bounded LRU of users resolved from verified tokens, keyed by token signature.
+
+    Each entry remembers the user's auth version from Redis, and an entry from an older version is a miss,
+    so a change made through any worker invalidates the entries of all of them.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.signatures_by_user = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, signature, version):
+        with self.lock:
+            entry = self.entries.get(signature)
+            if entry is None or entry[1] <= time.monotonic() or entry[2] != version:
+                if entry is not None:
+                    self.remove(signature)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(signature)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, signature, user, token_expires_at, version):
+        # never outlive the token itself
+        ttl = min(self.ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        with self.lock:
+            self.remove(signature)
+            self.entries[signature] = (user, time.monotonic() + ttl, version)
+            self.signatures_by_user[user.id].add(signature)
+
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for signature in list(self.signatures_by_user.get(user_id, ())):
+                self.remove(signature)
+
+    def remove(self, signature):
+        entry = self.entries.pop(signature, None)
+        if entry is not None:
+            signatures = self.signatures_by_user[entry[0].id]
+            signatures.discard(signature)
+            if not signatures:
+                del self.signatures_by_user[entry[0].id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+token_user_cache = TokenUserCache(settings.WS_AUTH_CACHE_SIZE, settings.WS_AUTH_CACHE_TTL)
+
+
 class JWTAuthMiddleware:
     def __init__(self, app):
         self.app = app
@@ -21,7 +126,17 @@ class JWTAuthMiddleware:
         try:
             token = parse_qs(scope["query_string"].decode("utf8")).get('token', None)[0]
             decoded_data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            scope["user"] = await self.get_user(decoded_data['user_id'])
+
+            # the signature was just verified, so it identifies this exact token
+            signature = token.rsplit(".", 1)[1]
+            # read before the user, so a change committed in between leaves the cached copy outdated
+            version = await get_auth_version(decoded_data['user_id'])
+            user = token_user_cache.get(signature, version) if version is not None else None
+            if user is None:
+                user = await self.get_user(decoded_data['user_id'])
+                if user.is_authenticated and version is not None:
+                    token_user_cache.set(signature, user, decoded_data.get("exp", 0), version)
+            scope["user"] = user
 
         except (TypeError, KeyError, InvalidSignatureError, ExpiredSignatureError, DecodeError):
             scope["user"] = AnonymousUser()
@@ -37,4 +152,26 @@ class JWTAuthMiddleware:
             return AnonymousUser()
 
 def JWTAuthMiddlewareStack(app):
-    return JWTAuthMiddleware(AuthMiddlewareStack(app))
\ No newline at end of file
+    return JWTAuthMiddleware(AuthMiddlewareStack(app))
+
+
+class ReplicaPinningMiddleware:
+    """Keeps a client on the primary database for REPLICA_PIN_SECONDS after it writes."""
+
+    cookie_name = "pin_primary"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = pinned_to_primary.set(
+            request.method not in SAFE_METHODS or self.cookie_name in request.COOKIES
+        )
+        try:
+            response = self.get_response(request)
+            # replicas lag behind, so the client's next reads must not go to one either
+            if request.method not in SAFE_METHODS:
+                response.set_cookie(self.cookie_name, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+            return response
+        finally:
+            pinned_to_primary.reset(token)
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_task_updated_at_deletedtask'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grouptask',
+            index=models.Index(fields=['group', 'deadline'], name='grouptask_group_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouptask',
+            index=models.Index(fields=['group', 'state', 'deadline'], name='grouptask_group_state_dl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouptask',
+            index=models.Index(fields=['group', 'updated_at'], name='grouptask_group_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouptask',
+            index=models.Index(condition=models.Q(('state', 0)), fields=['deadline'], name='grouptask_pending_dl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['user', 'deadline'], name='usertask_user_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['user', 'state', 'deadline'], name='usertask_user_state_dl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(fields=['user', 'updated_at'], name='usertask_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertask',
+            index=models.Index(condition=models.Q(('state', 0)), fields=['deadline'], name='usertask_pending_dl_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_task_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='groups_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
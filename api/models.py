@@ -1,5 +1,13 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import F, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+
+# sent once per deletion of tasks with their (id, owner id) pairs. A post_delete receiver would cost a query per task
+# and turn off Django's fast delete for owner cascades, which DeletedTask.record_owner_deletion() tombstones instead.
+tasks_deleted = Signal()
 
 
 class User(AbstractUser):
@@ -7,6 +15,10 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     sex = models.BooleanField(choices=[(True, "Male"), (False, "Female")])
     birth_date = models.DateField()
+    # bumped whenever anything in the user's login snapshot changes, used as its ETag
+    data_version = models.PositiveBigIntegerField(default=0)
+    # last time the user joined or left a group, /sync/ cursors from before it are answered with 410
+    groups_changed_at = models.DateTimeField(null=True, blank=True)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "sex", "birth_date"]
@@ -14,6 +26,10 @@ class User(AbstractUser):
     def __str__(self):
         return f"ID:{self.id:>3} | {self.username} | {self.email}"
 
+    @classmethod
+    def bump_data_version(cls, **lookups):
+        cls.objects.filter(**lookups).update(data_version=F("data_version") + 1)
+
 
 class Group(models.Model):
     name = models.CharField(max_length=63)
@@ -36,22 +52,48 @@ class UserGroupRelation(models.Model):
         return f"ID:{self.id:>3} | {self.user.username} - {self.group.name}"
 
 
+class TaskQuerySet(models.QuerySet):
+    def delete(self):
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        with transaction.atomic(using=using, savepoint=False):
+            rows = list(self.using(using).values_list("id", self.model.owner_field))
+            deleted = super().delete()
+            tasks_deleted.send(self.model, rows=rows, using=using)
+        return deleted
+
+
 class Task(models.Model):
     name = models.CharField(max_length=63)
     description = models.TextField(blank=True, null=True)
     deadline = models.DateTimeField()
     state = models.PositiveSmallIntegerField(choices=[(0, 'uncompleted'), (1, 'completed'), (2, 'expired')], default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TaskQuerySet.as_manager()
 
     class Meta:
         abstract = True
         ordering = ["deadline"]
 
+    def delete(self, using=None, keep_parents=False):
+        # goes through TaskQuerySet.delete(), so single deletes send tasks_deleted as well
+        return type(self).objects.db_manager(using).filter(pk=self.pk).delete()
+
 
 class UserTask(Task):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tasks")
 
+    owner_field = "user_id"
+
     class Meta(Task.Meta):
-        indexes = [models.Index(fields=["deadline"])]
+        indexes = [
+            models.Index(fields=["deadline"]),
+            models.Index(fields=["user", "deadline"], name="usertask_user_deadline_idx"),
+            models.Index(fields=["user", "state", "deadline"], name="usertask_user_state_dl_idx"),
+            models.Index(fields=["user", "updated_at"], name="usertask_user_updated_idx"),
+            # only uncompleted tasks can expire, so the expiry scan skips everything else
+            models.Index(fields=["deadline"], condition=Q(state=0), name="usertask_pending_dl_idx"),
+        ]
 
     def __str__(self):
         return f"ID:{self.id:>3} | {self.name} | User:{self.user.username}"
@@ -60,8 +102,48 @@ class UserTask(Task):
 class GroupTask(Task):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="tasks")
 
+    owner_field = "group_id"
+
     class Meta(Task.Meta):
-        indexes = [models.Index(fields=["deadline"])]
+        indexes = [
+            models.Index(fields=["deadline"]),
+            models.Index(fields=["group", "deadline"], name="grouptask_group_deadline_idx"),
+            models.Index(fields=["group", "state", "deadline"], name="grouptask_group_state_dl_idx"),
+            models.Index(fields=["group", "updated_at"], name="grouptask_group_updated_idx"),
+            models.Index(fields=["deadline"], condition=Q(state=0), name="grouptask_pending_dl_idx"),
+        ]
 
     def __str__(self):
         return f"ID:{self.id:>3} | {self.name} | Group:{self.group.name}"
+
+
+class DeletedTask(models.Model):
+    # tombstone for /sync/; plain ids so it survives the deletion of the owning user or group
+    task_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    group_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_id", "deleted_at"]),
+            models.Index(fields=["group_id", "deleted_at"]),
+        ]
+
+    @classmethod
+    def record_owner_deletion(cls, task_model, owner_id, using):
+        """Tombstones all tasks of a user or group that is being deleted with a single INSERT ... SELECT."""
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        # the owner column has the same name in both tables
+        owner = quote(task_model.owner_field)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(cls._meta.db_table)} (task_id, {owner}, deleted_at) "
+                f"SELECT id, {owner}, %s FROM {quote(task_model._meta.db_table)} WHERE {owner} = %s",
+                [connection.ops.adapt_datetimefield_value(timezone.now()), owner_id]
+            )
+
+    def __str__(self):
+        owner = f"User:{self.user_id}" if self.user_id else f"Group:{self.group_id}"
+        return f"ID:{self.id:>3} | Task:{self.task_id} | {owner}"
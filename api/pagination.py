@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DeadlineCursorPagination(CursorPagination):
+    # keyset pagination over the deadline index; id breaks ties between equal deadlines
+    ordering = ("deadline", "id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
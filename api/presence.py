@@ -0,0 +1,132 @@
+from django.conf import settings
+
+from .redis_pool import get_redis, get_async_redis, register_script, register_async_script
+
+# user id -> number of open sockets
+PRESENCE_COUNTS_KEY = "presence:counts"
+# user id -> username, holds exactly the users that are online
+PRESENCE_NAMES_KEY = "presence:names"
+# "<user id>:<channel name>" scored by the socket's last heartbeat, in Redis server time
+PRESENCE_SOCKETS_KEY = "presence:sockets"
+
+PRESENCE_KEYS = [PRESENCE_COUNTS_KEY, PRESENCE_NAMES_KEY, PRESENCE_SOCKETS_KEY]
+
+CONNECT_SCRIPT = """
+local now = redis.call('TIME')[1]
+redis.call('ZADD', KEYS[3], now, ARGV[3])
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+if count == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+return count
+"""
+
+# a socket that was reaped while still alive (e.g. a stalled event loop) registers itself again
+HEARTBEAT_SCRIPT = """
+local now = redis.call('TIME')[1]
+if redis.call('ZSCORE', KEYS[3], ARGV[3]) then
+    redis.call('ZADD', KEYS[3], now, ARGV[3])
+    return 0
+end
+redis.call('ZADD', KEYS[3], now, ARGV[3])
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+if count == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+return count
+"""
+
+# returns -1 when the socket was already reaped, so it is not counted down twice
+DISCONNECT_SCRIPT = """
+if redis.call('ZREM', KEYS[3], ARGV[2]) == 0 then
+    return -1
+end
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return count
+"""
+
+REAP_SCRIPT = """
+local cutoff = tonumber(redis.call('TIME')[1]) - tonumber(ARGV[1])
+local sockets = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', cutoff, 'LIMIT', 0, tonumber(ARGV[2]))
+local offline = {}
+for _, socket in ipairs(sockets) do
+    redis.call('ZREM', KEYS[3], socket)
+    local user_id = string.match(socket, '^(%d+):')
+    local count = redis.call('HINCRBY', KEYS[1], user_id, -1)
+    if count <= 0 then
+        redis.call('HDEL', KEYS[1], user_id)
+        redis.call('HDEL', KEYS[2], user_id)
+        table.insert(offline, user_id)
+    end
+end
+return {#sockets, offline}
+"""
+
+connect_script = register_async_script(CONNECT_SCRIPT)
+heartbeat_script = register_async_script(HEARTBEAT_SCRIPT)
+disconnect_script = register_async_script(DISCONNECT_SCRIPT)
+reap_script = register_script(REAP_SCRIPT)
+
+
+def socket_member(user_id, channel_name):
+    return f"{user_id}:{channel_name}"
+
+
+async def user_connected(user, channel_name):
+    """Register the user's socket, return True if they just came online."""
+    count = await connect_script(
+        keys=PRESENCE_KEYS,
+        args=[user.id, user.username, socket_member(user.id, channel_name)],
+        client=get_async_redis()
+    )
+    return count == 1
+
+
+async def socket_heartbeat(user, channel_name):
+    """Refresh the socket's last-seen time, return True if the user came back online."""
+    count = await heartbeat_script(
+        keys=PRESENCE_KEYS,
+        args=[user.id, user.username, socket_member(user.id, channel_name)],
+        client=get_async_redis()
+    )
+    return count == 1
+
+
+async def user_disconnected(user_id, channel_name):
+    """Drop the user's socket, return True if it was their last one."""
+    count = await disconnect_script(
+        keys=PRESENCE_KEYS,
+        args=[user_id, socket_member(user_id, channel_name)],
+        client=get_async_redis()
+    )
+    return count == 0
+
+
+def reap_sockets(batch_size=1000):
+    """Remove one batch of sockets that missed PRESENCE_TIMEOUT seconds of heartbeats.
+
+    Returns the number of reaped sockets and the ids of users that went offline.
+    """
+    reaped, offline = reap_script(
+        keys=PRESENCE_KEYS,
+        args=[settings.PRESENCE_TIMEOUT, batch_size],
+        client=get_redis()
+    )
+    return reaped, [int(user_id) for user_id in offline]
+
+
+async def all_online_users():
+    return [
+        {"id": int(user_id), "username": username.decode()}
+        async for user_id, username in get_async_redis().hscan_iter(PRESENCE_NAMES_KEY, count=1000)
+    ]
+
+
+def online_users(cursor=0, count=100):
+    next_cursor, names = get_redis().hscan(PRESENCE_NAMES_KEY, cursor=cursor, count=count)
+    users = [{"id": int(user_id), "username": username.decode()} for user_id, username in names.items()]
+    return next_cursor, users
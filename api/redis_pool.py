@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import threading
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from redis.commands.core import AsyncScript, Script
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.saturated_checkouts = 0
+        # redis-py releases connections that fail to connect before get_connection() returns them
+        self.counted = set()
+        self.lock = threading.Lock()
+
+    def checked_out(self, connection):
+        with self.lock:
+            self.counted.add(connection)
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            saturated = self.in_use >= self.max_connections
+            if saturated:
+                self.saturated_checkouts += 1
+
+        # the next caller will have to wait for a connection to be released
+        if saturated:
+            logger.warning("Redis connection pool saturated (%d connections in use).", self.max_connections)
+
+    def released(self, connection):
+        with self.lock:
+            if connection not in self.counted:
+                return
+            self.counted.remove(connection)
+            self.in_use -= 1
+
+    def as_dict(self):
+        return {
+            "max_connections": self.max_connections,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "checkouts": self.checkouts,
+            "saturated_checkouts": self.saturated_checkouts,
+        }
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(self.max_connections)
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        self.stats.checked_out(connection)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        self.stats.released(connection)
+
+
+class InstrumentedAsyncConnectionPool(aioredis.BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(self.max_connections)
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self.stats.checked_out(connection)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.stats.released(connection)
+
+
+_sync_client = None
+# asyncio connections cannot be shared between event loops, so there is one async client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def pool_options():
+    return {
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+    }
+
+
+def get_redis():
+    global _sync_client
+    if _sync_client is None:
+        pool = InstrumentedConnectionPool.from_url(settings.REDIS_URL, **pool_options())
+        _sync_client = redis.Redis(connection_pool=pool)
+    return _sync_client
+
+
+def get_async_redis():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = InstrumentedAsyncConnectionPool.from_url(settings.REDIS_URL, **pool_options())
+        client = _async_clients[loop] = aioredis.Redis(connection_pool=pool)
+    return client
+
+
+def pipeline(transaction=True):
+    return get_redis().pipeline(transaction=transaction)
+
+
+def async_pipeline(transaction=True):
+    return get_async_redis().pipeline(transaction=transaction)
+
+
+def register_script(source):
+    """Lua script callable as script(keys=..., args=..., client=get_redis())."""
+    return Script(None, source.encode())
+
+
+def register_async_script(source):
+    """Lua script callable as await script(keys=..., args=..., client=get_async_redis())."""
+    return AsyncScript(None, source.encode())
+
+
+def pool_stats():
+    stats = {"sync": _sync_client.connection_pool.stats.as_dict() if _sync_client else None}
+    for index, client in enumerate(_async_clients.values()):
+        stats[f"async_{index}"] = client.connection_pool.stats.as_dict()
+    return stats
+
+
+@receiver(setting_changed)
+def reset_clients(setting, **kwargs):
+    global _sync_client
+    if setting in ("REDIS_URL", "REDIS_MAX_CONNECTIONS", "REDIS_POOL_TIMEOUT"):
+        _sync_client = None
+        _async_clients.clear()
@@ -0,0 +1,43 @@
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DATABASE = "replica"
+
+# set for the rest of a request (or consumer command) once it has written, so it reads its own writes
+pinned_to_primary = contextvars.ContextVar("pinned_to_primary", default=False)
+
+
+def pin_to_primary():
+    pinned_to_primary.set(True)
+
+
+class PrimaryReplicaRouter:
+    """Sends reads to the replica and everything else to the primary.
+
+    Reads stay on the primary after a write in the same context, inside a transaction,
+    and when no replica is configured.
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DATABASE not in settings.DATABASES or pinned_to_primary.get():
+            return DEFAULT_DB_ALIAS
+        # select_for_update() and reads inside atomic() must see the transaction's own writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DATABASE
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica receives schema changes through replication
+        if db == REPLICA_DATABASE:
+            return False
+        return None
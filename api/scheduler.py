@@ -0,0 +1,133 @@
+import heapq
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import group_cache
+from .consumers import encode_group_event
+from .models import User, UserTask, GroupTask
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Expires uncompleted tasks once their deadline passes.
+
+    Upcoming deadlines are loaded from the deadline index into a min-heap and
+    expired with one bulk UPDATE per model per tick.
+    """
+
+    models = (UserTask, GroupTask)
+
+    def __init__(self, refresh_interval=60, batch_size=1000):
+        self.refresh_interval = timedelta(seconds=refresh_interval)
+        self.batch_size = batch_size
+        self.heap = []
+        self.next_refresh = None
+
+    def refresh(self, now):
+        horizon = now + self.refresh_interval
+        self.heap = []
+        self.next_refresh = horizon
+
+        for model in self.models:
+            rows = list(
+                model.objects.filter(state=0, deadline__lte=horizon)
+                .order_by("deadline")
+                .values_list("deadline", "id")[:self.batch_size]
+            )
+            self.heap.extend((deadline, model.__name__, task_id) for deadline, task_id in rows)
+
+            # a full batch means there may be more due tasks; reload as soon as this batch is consumed
+            if len(rows) == self.batch_size:
+                self.next_refresh = min(self.next_refresh, rows[-1][0])
+
+        heapq.heapify(self.heap)
+
+    def tick(self, now=None):
+        now = now or timezone.now()
+        if self.next_refresh is None or now >= self.next_refresh:
+            self.refresh(now)
+
+        due = {model.__name__: [] for model in self.models}
+        while self.heap and self.heap[0][0] <= now:
+            _, model_name, task_id = heapq.heappop(self.heap)
+            due[model_name].append(task_id)
+
+        expired = 0
+        if due["UserTask"]:
+            expired += self.expire_user_tasks(due["UserTask"], now)
+        if due["GroupTask"]:
+            expired += self.expire_group_tasks(due["GroupTask"], now)
+        return expired
+
+    def expire_user_tasks(self, task_ids, now):
+        with transaction.atomic():
+            # the deadline check skips tasks whose deadline was moved after the heap was loaded
+            rows = list(
+                UserTask.objects.select_for_update()
+                .filter(id__in=task_ids, state=0, deadline__lte=now)
+                .values_list("id", "user_id")
+            )
+            UserTask.objects.filter(id__in=[task_id for task_id, _ in rows]).update(state=2, updated_at=now)
+            # bulk updates skip signals, so the owners' snapshot versions are bumped here
+            User.bump_data_version(pk__in={user_id for _, user_id in rows})
+        return len(rows)
+
+    def expire_group_tasks(self, task_ids, now):
+        with transaction.atomic():
+            rows = list(
+                GroupTask.objects.select_for_update()
+                .filter(id__in=task_ids, state=0, deadline__lte=now)
+                .values_list("id", "group_id")
+            )
+            GroupTask.objects.filter(id__in=[task_id for task_id, _ in rows]).update(state=2, updated_at=now)
+            group_cache.invalidate(*{group_id for _, group_id in rows})
+
+        task_ids_by_group = defaultdict(list)
+        for task_id, group_id in rows:
+            task_ids_by_group[group_id].append(task_id)
+        if task_ids_by_group:
+            async_to_sync(self.broadcast_expired)(task_ids_by_group)
+        return len(rows)
+
+    async def broadcast_expired(self, task_ids_by_group):
+        channel_layer = get_channel_layer()
+        for group_id, task_ids in task_ids_by_group.items():
+            try:
+                await channel_layer.group_send(
+                    f"group_{group_id}",
+                    encode_group_event({
+                        "type": "group.tasks_expired",
+                        "task_ids": task_ids
+                    })
+                )
+            except redis.RedisError:
+                # the tasks are already expired in the database, clients pick the change up through /sync/
+                logger.warning("Could not broadcast expired tasks %s of group %s.", task_ids, group_id, exc_info=True)
+
+    def seconds_until_next(self, now, max_sleep):
+        wake_at = self.next_refresh
+        if self.heap:
+            wake_at = min(wake_at, self.heap[0][0])
+        return max(0, min((wake_at - now).total_seconds(), max_sleep))
+
+    def run_forever(self, max_sleep=5):
+        while True:
+            try:
+                self.tick()
+            except DatabaseError:
+                logger.exception("Expiring tasks failed, retrying in %s seconds.", max_sleep)
+                # the popped tasks are still uncompleted in the database, so the next tick reloads them
+                self.next_refresh = None
+                time.sleep(max_sleep)
+                continue
+            time.sleep(self.seconds_until_next(timezone.now(), max_sleep))
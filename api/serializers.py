@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import User, Group, UserTask, GroupTask
 
@@ -35,20 +36,33 @@ class GroupTaskSerializer(serializers.ModelSerializer):
 
 
 class GroupDetailSerializer(serializers.ModelSerializer):
+    # only the nearest deadlines are embedded, the full list is paged through /groups/<id>/tasks/
+    task_limit = 50
+
     members = serializers.SerializerMethodField()
     tasks = serializers.SerializerMethodField()
+    has_more_tasks = serializers.SerializerMethodField()
 
     class Meta:
         model = Group
-        fields = ["id", "name", "members", "tasks"]
+        fields = ["id", "name", "members", "tasks", "has_more_tasks"]
 
     def get_members(self, group):
-        users = User.objects.filter(user_groups__group=group)
+        # goes through group_users so GroupViewSet can prefetch members together with the group
+        users = [relation.user for relation in group.group_users.all()]
         return UserSerializer(users, many=True).data
 
     def get_tasks(self, group):
-        tasks = group.tasks.all()
-        return GroupTaskSerializer(tasks, many=True).data
+        return GroupTaskSerializer(self.upcoming_tasks(group)[:self.task_limit], many=True).data
+
+    def get_has_more_tasks(self, group):
+        return len(self.upcoming_tasks(group)) > self.task_limit
+
+    def upcoming_tasks(self, group):
+        # GroupViewSet prefetches one task past the limit into upcoming_tasks
+        if not hasattr(group, "upcoming_tasks"):
+            group.upcoming_tasks = list(group.tasks.order_by("deadline", "id")[:self.task_limit + 1])
+        return group.upcoming_tasks
 
 
 class LoginResponseSerializer(serializers.Serializer):
@@ -59,15 +73,11 @@ class LoginResponseSerializer(serializers.Serializer):
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
-        email = attrs.get("email")
-        password = attrs.get("password")
-
-        user = User.objects.filter(email=email).first()
-        if not user or not user.check_password(password):
+        try:
+            return super().validate(attrs)
+        except AuthenticationFailed:
             raise serializers.ValidationError("Invalid email or password")
 
-        return super().validate(attrs)
-
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
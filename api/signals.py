@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import group_cache
+from .authentication import set_revoked
+from .middleware import bump_auth_version, token_user_cache
+from .models import User, Group, UserGroupRelation, UserTask, GroupTask, DeletedTask, tasks_deleted
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # logins and transparent password rehashes do not change the snapshot
+    if created or (update_fields and update_fields <= {"last_login", "password"}):
+        return
+    User.bump_data_version(pk=instance.pk)
+    # usernames and profiles are part of the group member lists
+    group_cache.invalidate(*UserGroupRelation.objects.filter(user_id=instance.pk).values_list("group_id", flat=True))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        User.bump_data_version(user_groups__group=instance)
+        group_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=UserGroupRelation)
+@receiver(post_delete, sender=UserGroupRelation)
+def membership_changed(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.user_id).update(
+        data_version=F("data_version") + 1,
+        groups_changed_at=timezone.now()
+    )
+    group_cache.invalidate(instance.group_id)
+
+
+@receiver(post_save, sender=GroupTask)
+def group_task_changed(sender, instance, **kwargs):
+    group_cache.invalidate(instance.group_id)
+
+
+@receiver(tasks_deleted, sender=GroupTask)
+def group_tasks_deleted(sender, rows, **kwargs):
+    group_cache.invalidate(*{group_id for _, group_id in rows})
+
+
+@receiver(post_save, sender=UserTask)
+def user_task_changed(sender, instance, **kwargs):
+    User.bump_data_version(pk=instance.user_id)
+
+
+@receiver(tasks_deleted, sender=UserTask)
+def user_tasks_deleted(sender, rows, **kwargs):
+    # owner cascades send no tasks_deleted, so a user that is being deleted is never bumped
+    User.bump_data_version(pk__in={user_id for _, user_id in rows})
+
+
+@receiver(tasks_deleted, sender=UserTask)
+@receiver(tasks_deleted, sender=GroupTask)
+def record_deleted_tasks(sender, rows, using, **kwargs):
+    DeletedTask.objects.using(using).bulk_create(
+        DeletedTask(task_id=task_id, **{sender.owner_field: owner_id}) for task_id, owner_id in rows
+    )
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, using, **kwargs):
+    # cascades delete the tasks without tasks_deleted, so they are tombstoned while they still exist
+    DeletedTask.record_owner_deletion(UserTask, instance.pk, using)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, using, **kwargs):
+    DeletedTask.record_owner_deletion(GroupTask, instance.pk, using)
+    group_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_token_user(sender, instance, signal, **kwargs):
+    token_user_cache.invalidate_user(instance.pk)
+    # the other workers see the new version on their next handshake for this user
+    bump_auth_version(instance.pk)
+    # ClaimsJWTAuthentication skips the user query and checks this marker instead
+    set_revoked(instance.pk, signal is post_delete or not instance.is_active)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite" or not settings.SQLITE_TUNING:
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
@@ -1,3 +1,976 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import sys
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from uuid import UUID
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+import fakeredis.aioredis
+import msgpack
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.http import HttpResponse
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import renderers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import group_cache, json_codec, presence
+from .authentication import revoked_key
+from .consumers import BATCH_MAX_OPERATIONS, encode_group_event
+from .middleware import JWTAuthMiddleware, ReplicaPinningMiddleware, TokenUserCache, auth_version_key
+from .models import User, Group, UserGroupRelation, UserTask, GroupTask, DeletedTask
+from .redis_pool import get_redis
+from .routers import PrimaryReplicaRouter, pinned_to_primary
+from .scheduler import DeadlineScheduler
+from .serializers import GroupDetailSerializer
+from .views import encode_cursor
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def use_fake_redis(test):
+    """Points the shared sync Redis client at a fresh in-process server for the duration of the test."""
+    server = fakeredis.FakeServer()
+    patcher = mock.patch("api.redis_pool._sync_client", fakeredis.FakeRedis(server=server))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return server
+
+
+def create_user(n):
+    return User.objects.create_user(
+        email=f"user{n}@example.com",
+        username=f"user{n}",
+        password=None,
+        sex=True,
+        birth_date=date(2000, 1, 1),
+    )
+
+
+class GroupQueryCountTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.owner = create_user(0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def create_group(self, members, tasks):
+        group = Group.objects.create(name=f"group with {members} members")
+        users = [self.owner] + [create_user(f"{group.id}-{n}") for n in range(members - 1)]
+        UserGroupRelation.objects.bulk_create([UserGroupRelation(user=user, group=group) for user in users])
+        deadline = timezone.now() + timedelta(days=1)
+        GroupTask.objects.bulk_create([GroupTask(name=f"task {n}", deadline=deadline, group=group) for n in range(tasks)])
+        return group
+
+    def test_retrieve_query_count_does_not_grow_with_group_size(self):
+        limit = GroupDetailSerializer.task_limit
+        for members, tasks in [(1, 0), (5, 5), (40, limit), (40, limit + 100)]:
+            group = self.create_group(members, tasks)
+            # group, members with their users, tasks
+            with self.assertNumQueries(3):
+                response = self.client.get(f"/api/groups/{group.id}/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["members"]), members)
+            self.assertEqual(len(response.data["tasks"]), min(tasks, limit))
+            self.assertEqual(response.data["has_more_tasks"], tasks > limit)
+
+    def test_list_query_count_does_not_grow_with_group_count(self):
+        for count in [1, 10, 50]:
+            for _ in range(count):
+                self.create_group(1, 1)
+            with self.assertNumQueries(1):
+                response = self.client.get("/api/groups/")
+            self.assertEqual(response.status_code, 200)
+
+
+class JSONCodecTests(SimpleTestCase):
+    payload = {
+        "id": 1,
+        "name": "Zoë 🙂",
+        "description": None,
+        "tags": ["a", "b"],
+        "price": Decimal("1.50"),
+        "done": False,
+        "deadline": datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+        "birth_date": date(2000, 1, 1),
+        "uuid": UUID("12345678-1234-5678-1234-567812345678"),
+        7: "non-string key",
+    }
+    # what DRF's JSONRenderer wrote before the codec was introduced
+    expected = renderers.JSONRenderer().render(payload)
+
+    def reload_codec(self, **overrides):
+        self.addCleanup(importlib.reload, json_codec)
+        with override_settings(**overrides):
+            importlib.reload(json_codec)
+
+    def test_renderer_writes_compact_utf8(self):
+        self.assertEqual(json_codec.JSONRenderer().render(self.payload), self.expected)
+        self.assertEqual(json_codec.JSONRenderer().render(None), b"")
+
+    def test_indented_output_uses_drf_encoder(self):
+        output = json_codec.JSONRenderer().render(self.payload, "application/json; indent=2")
+        self.assertIn(b"\n  ", output)
+        self.assertEqual(json.loads(output), json.loads(self.expected))
+
+    def test_stdlib_codec_renders_the_same_bytes(self):
+        self.reload_codec(JSON_CODEC="stdlib")
+        self.assertFalse(json_codec.use_orjson)
+        self.assertEqual(json_codec.JSONRenderer().render(self.payload), self.expected)
+        self.assertEqual(json_codec.loads(self.expected)["deadline"], "2026-01-02T03:04:05.678901Z")
+
+    def test_missing_orjson_falls_back_to_stdlib(self):
+        with mock.patch.dict(sys.modules, {"orjson": None}):
+            self.reload_codec(JSON_CODEC="orjson")
+        self.assertFalse(json_codec.use_orjson)
+        self.assertEqual(json_codec.dumps_text({"a": 1}), '{"a":1}')
+
+
+class JSONParseErrorTests(TestCase):
+    def test_malformed_body_is_a_bad_request(self):
+        self.addCleanup(importlib.reload, json_codec)
+        for codec in ("orjson", "stdlib"):
+            with override_settings(JSON_CODEC=codec):
+                importlib.reload(json_codec)
+                response = self.client.post("/api/register/", b'{"email": ', content_type="application/json")
+            self.assertEqual(response.status_code, 400, codec)
+            self.assertTrue(response.json()["detail"].startswith("JSON parse error"), codec)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        replica = mock.patch.dict(settings.DATABASES, {"replica": settings.DATABASES["default"]})
+        replica.start()
+        self.addCleanup(replica.stop)
+        token = pinned_to_primary.set(False)
+        self.addCleanup(pinned_to_primary.reset, token)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(GroupTask), "replica")
+
+    def test_reads_after_write_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(GroupTask), "default")
+        self.assertEqual(self.router.db_for_read(GroupTask), "default")
+
+    def test_without_replica_reads_go_to_primary(self):
+        del settings.DATABASES["replica"]
+        self.assertEqual(self.router.db_for_read(GroupTask), "default")
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(self.router.allow_migrate("replica", "api"))
+        self.assertIsNone(self.router.allow_migrate("default", "api"))
+
+    def run_request(self, method, **cookies):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(GroupTask))
+            return HttpResponse()
+
+        factory = RequestFactory()
+        factory.cookies.load(cookies)
+        response = ReplicaPinningMiddleware(view)(factory.generic(method, "/"))
+        return reads[0], response
+
+    def test_safe_request_reads_replica(self):
+        db, response = self.run_request("GET")
+        self.assertEqual(db, "replica")
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+    def test_unsafe_request_pins_client(self):
+        db, response = self.run_request("POST")
+        self.assertEqual(db, "default")
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+        self.assertFalse(pinned_to_primary.get())
+
+    def test_pinned_client_reads_primary(self):
+        db, _ = self.run_request("GET", **{ReplicaPinningMiddleware.cookie_name: "1"})
+        self.assertEqual(db, "default")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class GroupConsumerTests(TransactionTestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        # presence is covered by PresenceTests, these tests only exercise task commands
+        for name in ("user_connected", "user_disconnected", "socket_heartbeat"):
+            patcher = mock.patch(f"api.presence.{name}", mock.AsyncMock(return_value=False))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = create_user(0)
+        self.group = Group.objects.create(name="group")
+        UserGroupRelation.objects.create(user=self.user, group=self.group)
+        self.deadline = (timezone.now() + timedelta(days=1)).isoformat()
+        self.first = GroupTask.objects.create(name="first", deadline=self.deadline, group=self.group)
+        self.second = GroupTask.objects.create(name="second", deadline=self.deadline, group=self.group)
+
+    async def connect(self, group=None, subprotocols=None):
+        from .routing import ws_urlpatterns
+
+        group = group or self.group
+        communicator = WebsocketCommunicator(URLRouter(ws_urlpatterns), f"/ws/groups/{group.id}/", subprotocols=subprotocols)
+        communicator.scope["user"] = self.user
+        connected, self.subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_from()
+        return communicator
+
+    async def send_batch(self, communicator, operations):
+        await communicator.send_json_to({"command": "batch", "data": operations})
+        return await communicator.receive_json_from()
+
+    async def test_batch_applies_all_operations_in_one_event(self):
+        communicator = await self.connect()
+        event = await self.send_batch(communicator, [
+            {"command": "create", "data": {"name": "new", "deadline": self.deadline}},
+            {"command": "update", "data": {"id": self.first.id, "name": "renamed"}},
+            {"command": "complete", "data": self.first.id},
+            {"command": "delete", "data": self.second.id},
+        ])
+
+        self.assertEqual(event["event"], "tasks_changed")
+        self.assertEqual([task["name"] for task in event["created"]], ["new"])
+        self.assertEqual(event["created"][0]["group"], self.group.id)
+        self.assertEqual([(task["id"], task["name"], task["state"]) for task in event["updated"]], [(self.first.id, "renamed", 1)])
+        self.assertEqual(event["deleted"], [self.second.id])
+
+        first = await GroupTask.objects.aget(id=self.first.id)
+        self.assertEqual((first.name, first.state), ("renamed", 1))
+        self.assertGreater(first.updated_at, self.first.updated_at)
+        self.assertFalse(await GroupTask.objects.filter(id=self.second.id).aexists())
+        self.assertTrue(await DeletedTask.objects.filter(task_id=self.second.id, group_id=self.group.id).aexists())
+        await communicator.disconnect()
+
+    async def test_invalid_operation_rejects_whole_batch(self):
+        communicator = await self.connect()
+        reply = await self.send_batch(communicator, [
+            {"command": "create", "data": {"name": "new", "deadline": self.deadline}},
+            {"command": "delete", "data": self.second.id},
+            {"command": "update", "data": {"id": self.first.id, "deadline": "not a date"}},
+        ])
+
+        self.assertEqual(reply["index"], 2)
+        self.assertIn("deadline", reply["details"])
+        self.assertEqual(await GroupTask.objects.filter(group=self.group).acount(), 2)
+        self.assertFalse(await DeletedTask.objects.aexists())
+        await communicator.disconnect()
+
+    async def test_batch_errors_carry_operation_index(self):
+        communicator = await self.connect()
+        cases = [
+            ([{"command": "archive", "data": 1}], 0, "Unknown command."),
+            ([{"command": "complete", "data": self.first.id}, {"command": "delete", "data": "x"}], 1, "Task id must be an integer."),
+            ([{"command": "delete", "data": self.first.id}, {"command": "complete", "data": self.first.id}], 1, f"Task with id {self.first.id} does not exist."),
+        ]
+        for operations, index, message in cases:
+            reply = await self.send_batch(communicator, operations)
+            self.assertEqual((reply["index"], reply["error"]), (index, message))
+        await communicator.disconnect()
+
+    async def test_batch_size_is_limited(self):
+        communicator = await self.connect()
+        reply = await self.send_batch(communicator, [{"command": "delete", "data": self.first.id}] * (BATCH_MAX_OPERATIONS + 1))
+        self.assertEqual(reply, {"error": f"Batch cannot contain more than {BATCH_MAX_OPERATIONS} operations."})
+        await communicator.disconnect()
+
+    async def test_membership_is_read_from_the_primary(self):
+        # reads routed to this replica fail, since the connection handler does not know the alias
+        with mock.patch.dict(settings.DATABASES, {"replica": settings.DATABASES["default"]}):
+            communicator = await self.connect()
+            event = await self.send_batch(communicator, [{"command": "complete", "data": self.first.id}])
+        self.assertEqual(event["event"], "tasks_changed")
+        await communicator.disconnect()
+
+    async def test_heartbeat_survives_redis_errors(self):
+        recovered = asyncio.Event()
+        heartbeat = mock.AsyncMock(side_effect=[redis.ConnectionError(), redis.ConnectionError(), 0, 0])
+
+        async def socket_heartbeat(user, channel_name):
+            result = await heartbeat(user, channel_name)
+            recovered.set()
+            return result
+
+        with override_settings(PRESENCE_HEARTBEAT_INTERVAL=0.01), \
+                mock.patch("api.presence.socket_heartbeat", socket_heartbeat), \
+                self.assertLogs("api.consumers", "WARNING"):
+            communicator = await self.connect()
+            await asyncio.wait_for(recovered.wait(), 1)
+        await communicator.disconnect()
+
+    async def test_msgpack_subprotocol_round_trip(self):
+        communicator = await self.connect(subprotocols=["msgpack"])
+        self.assertEqual(self.subprotocol, "msgpack")
+
+        await communicator.send_to(bytes_data=msgpack.packb({"command": "complete", "data": self.first.id}))
+        self.assertEqual(msgpack.unpackb(await communicator.receive_from()), {"event": "task_completed", "task_id": self.first.id})
+        await communicator.disconnect()
+
+    async def test_json_is_kept_without_the_subprotocol(self):
+        communicator = await self.connect(subprotocols=["graphql-ws"])
+        self.assertIsNone(self.subprotocol)
+
+        await communicator.send_json_to({"command": "complete", "data": self.first.id})
+        self.assertEqual(await communicator.receive_json_from(), {"event": "task_completed", "task_id": self.first.id})
+        await communicator.disconnect()
+
+    async def test_malformed_msgpack_frame_is_answered_with_an_error(self):
+        communicator = await self.connect(subprotocols=["msgpack"])
+        for frame, error in [(b"\xc1", "Invalid msgpack frame."), (b"\x92\x01", "Invalid msgpack frame."), (msgpack.packb([1, 2]), "Frame must be a msgpack map.")]:
+            await communicator.send_to(bytes_data=frame)
+            self.assertEqual(msgpack.unpackb(await communicator.receive_from()), {"error": error})
+
+        # the consumer survived and still handles commands
+        await communicator.send_to(bytes_data=msgpack.packb({"command": "complete", "data": self.first.id}))
+        self.assertEqual(msgpack.unpackb(await communicator.receive_from())["event"], "task_completed")
+        await communicator.disconnect()
+
+    async def test_subscribers_forward_pre_encoded_frames(self):
+        json_client = await self.connect()
+        msgpack_client = await self.connect(subprotocols=["msgpack"])
+
+        # frames that re-encoding the event could never produce
+        await get_channel_layer().group_send(f"group_{self.group.id}", {
+            "type": "group.task_deleted",
+            "task_id": self.first.id,
+            "text": '{"pre-encoded":"text"}',
+            "msgpack": msgpack.packb({"pre-encoded": "msgpack"})
+        })
+        self.assertEqual(await json_client.receive_from(), '{"pre-encoded":"text"}')
+        self.assertEqual(msgpack.unpackb(await msgpack_client.receive_from()), {"pre-encoded": "msgpack"})
+
+        # events from elsewhere without the encoded frames are still encoded per subscriber
+        await get_channel_layer().group_send(f"group_{self.group.id}", {"type": "group.task_deleted", "task_id": self.first.id})
+        self.assertEqual(await json_client.receive_json_from(), {"event": "task_deleted", "task_id": self.first.id})
+        self.assertEqual(msgpack.unpackb(await msgpack_client.receive_from()), {"event": "task_deleted", "task_id": self.first.id})
+
+        await json_client.disconnect()
+        await msgpack_client.disconnect()
+
+    def test_encode_group_event_encodes_the_client_frame_once(self):
+        event = encode_group_event({"type": "group.task_completed", "task_id": 7, "internal": "not forwarded"})
+        frame = {"event": "task_completed", "task_id": 7}
+        self.assertEqual(json.loads(event["text"]), frame)
+        self.assertEqual(msgpack.unpackb(event["msgpack"]), frame)
+
+    async def test_tasks_of_other_groups_are_not_found(self):
+        other = await Group.objects.acreate(name="other")
+        await UserGroupRelation.objects.acreate(user=self.user, group=other)
+        communicator = await self.connect(other)
+
+        reply = await self.send_batch(communicator, [{"command": "complete", "data": self.first.id}])
+        self.assertEqual(reply["index"], 0)
+        await communicator.send_json_to({"command": "delete", "data": self.first.id})
+        self.assertEqual(await communicator.receive_json_from(), {"error": f"Task with id {self.first.id} does not exist."})
+        self.assertTrue(await GroupTask.objects.filter(id=self.first.id, state=0).aexists())
+        await communicator.disconnect()
+
+
+class PresenceTests(SimpleTestCase):
+    """Runs the presence Lua scripts against an in-process Redis."""
+
+    def setUp(self):
+        self.redis = fakeredis.aioredis.FakeRedis(server=use_fake_redis(self))
+        patcher = mock.patch("api.presence.get_async_redis", lambda: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = SimpleNamespace(id=1, username="user1")
+
+    def counts(self):
+        return {int(user_id): int(count) for user_id, count in get_redis().hgetall(presence.PRESENCE_COUNTS_KEY).items()}
+
+    async def online(self):
+        return await presence.all_online_users()
+
+    async def test_user_is_online_while_any_socket_is_connected(self):
+        self.assertTrue(await presence.user_connected(self.user, "first"))
+        self.assertFalse(await presence.user_connected(self.user, "second"))
+        self.assertEqual(self.counts(), {1: 2})
+        self.assertEqual(await self.online(), [{"id": 1, "username": "user1"}])
+
+        self.assertFalse(await presence.user_disconnected(self.user.id, "first"))
+        self.assertEqual(self.counts(), {1: 1})
+        self.assertTrue(await presence.user_disconnected(self.user.id, "second"))
+        self.assertEqual(self.counts(), {})
+        self.assertEqual(await self.online(), [])
+
+    async def test_double_disconnect_is_counted_once(self):
+        await presence.user_connected(self.user, "first")
+        await presence.user_connected(self.user, "second")
+        self.assertFalse(await presence.user_disconnected(self.user.id, "first"))
+        self.assertFalse(await presence.user_disconnected(self.user.id, "first"))
+        self.assertEqual(self.counts(), {1: 1})
+
+    async def test_reaper_removes_sockets_without_heartbeats(self):
+        other = SimpleNamespace(id=2, username="user2")
+        await presence.user_connected(self.user, "stale")
+        await presence.user_connected(other, "alive")
+        await self.redis.zadd(presence.PRESENCE_SOCKETS_KEY, {presence.socket_member(self.user.id, "stale"): 0})
+
+        self.assertEqual(presence.reap_sockets(), (1, [self.user.id]))
+        self.assertEqual(self.counts(), {2: 1})
+        self.assertEqual(await self.online(), [{"id": 2, "username": "user2"}])
+        # the socket's own disconnect comes after the reaper and must not count the user down again
+        self.assertFalse(await presence.user_disconnected(self.user.id, "stale"))
+        self.assertEqual(self.counts(), {2: 1})
+
+    async def test_heartbeat_registers_a_reaped_socket_again(self):
+        await presence.user_connected(self.user, "socket")
+        self.assertFalse(await presence.socket_heartbeat(self.user, "socket"))
+        self.assertEqual(self.counts(), {1: 1})
+
+        await self.redis.zadd(presence.PRESENCE_SOCKETS_KEY, {presence.socket_member(self.user.id, "socket"): 0})
+        presence.reap_sockets()
+        self.assertTrue(await presence.socket_heartbeat(self.user, "socket"))
+        self.assertEqual(self.counts(), {1: 1})
+        self.assertEqual(await self.online(), [{"id": 1, "username": "user1"}])
+
+
+class OnlineUsersViewTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.admin = create_user(0)
+        self.admin.is_staff = True
+        self.admin.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_pages_through_all_online_users(self):
+        names = {user_id: f"user{user_id}" for user_id in range(1, 301)}
+        get_redis().hset(presence.PRESENCE_NAMES_KEY, mapping=names)
+
+        seen = []
+        pages = 0
+        cursor = 0
+        while cursor is not None:
+            response = self.client.get("/api/online/", {"cursor": cursor, "count": 50})
+            self.assertEqual(response.status_code, 200)
+            seen += [(user["id"], user["username"]) for user in response.data["results"]]
+            cursor = response.data["next"]
+            pages += 1
+        self.assertGreater(pages, 1)
+        self.assertEqual(sorted(seen), sorted(names.items()))
+
+    def test_invalid_cursor_and_count_are_rejected(self):
+        for params in ({"cursor": "x"}, {"count": "many"}, {"cursor": -1}, {"cursor": 2 ** 64}, {"count": 0}, {"count": -5}):
+            self.assertEqual(self.client.get("/api/online/", params).status_code, 400, params)
+
+    def test_requires_staff(self):
+        client = APIClient()
+        client.force_authenticate(create_user(1))
+        self.assertEqual(client.get("/api/online/").status_code, 403)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, PRESENCE_FLUSH_INTERVAL=0.2)
+class AdminConsumerTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.aioredis.FakeRedis(server=use_fake_redis(self))
+        patcher = mock.patch("api.presence.get_async_redis", lambda: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_redis().hset(presence.PRESENCE_NAMES_KEY, mapping={1: "user1", 2: "user2"})
+
+    async def connect(self, is_staff=True):
+        from .routing import ws_urlpatterns
+
+        communicator = WebsocketCommunicator(URLRouter(ws_urlpatterns), "/ws/online/")
+        communicator.scope["user"] = SimpleNamespace(id=0, is_authenticated=True, is_staff=is_staff)
+        connected, _ = await communicator.connect()
+        return connected, communicator
+
+    async def announce(self, user_id, online):
+        event = {"type": "admin.online_status", "online": online}
+        if online:
+            event["user"] = {"id": user_id, "username": f"user{user_id}"}
+        else:
+            event["id"] = user_id
+        await get_channel_layer().group_send("admin_broadcast", event)
+
+    async def test_sends_online_snapshot(self):
+        connected, communicator = await self.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot["event"], "online_snapshot")
+        self.assertEqual(sorted(user["id"] for user in snapshot["users"]), [1, 2])
+        await communicator.disconnect()
+
+    async def test_rejects_non_staff(self):
+        connected, communicator = await self.connect(is_staff=False)
+        self.assertFalse(connected)
+
+    async def test_changes_within_an_interval_are_coalesced(self):
+        _, communicator = await self.connect()
+        await communicator.receive_json_from()
+
+        # user 3 flaps in, out and in again, user 1 goes out and user 2 comes and goes
+        for user_id, online in [(3, True), (3, False), (3, True), (1, False), (2, True), (2, False)]:
+            await self.announce(user_id, online)
+
+        diff = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(diff, {
+            "event": "presence_diff",
+            "users_in": [{"id": 3, "username": "user3"}],
+            "users_out": [1, 2]
+        })
+        # nothing changed since, so the next interval sends nothing
+        self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+        await communicator.disconnect()
+
+
+class SyncViewTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.group = Group.objects.create(name="group")
+        UserGroupRelation.objects.create(user=self.user, group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        deadline = timezone.now() + timedelta(days=1)
+        self.task = UserTask.objects.create(name="mine", deadline=deadline, user=self.user)
+        self.group_task = GroupTask.objects.create(name="ours", deadline=deadline, group=self.group)
+        GroupTask.objects.create(name="foreign", deadline=deadline, group=Group.objects.create(name="other"))
+
+    def sync(self, cursor=None):
+        return self.client.get("/api/sync/", {"since": cursor} if cursor is not None else {})
+
+    def test_full_sync_returns_all_tasks_of_the_user(self):
+        response = self.sync()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([task["id"] for task in response.data["tasks"]], [self.task.id])
+        self.assertEqual([task["id"] for task in response.data["group_tasks"]], [self.group_task.id])
+
+    def test_incremental_sync_returns_changes_and_deletions(self):
+        UserTask.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        GroupTask.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        cursor = self.sync().data["cursor"]
+
+        self.group_task.name = "renamed"
+        self.group_task.save()
+        task_id = self.task.id
+        self.task.delete()
+
+        response = self.sync(cursor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["tasks"], [])
+        self.assertEqual([task["name"] for task in response.data["group_tasks"]], ["renamed"])
+        self.assertEqual(response.data["deleted_tasks"], [task_id])
+        self.assertEqual(response.data["deleted_group_tasks"], [])
+
+    def test_invalid_and_expired_cursors(self):
+        self.assertEqual(self.sync("yesterday").status_code, 400)
+        expired = timezone.now() - settings.SYNC_TOMBSTONE_RETENTION - timedelta(minutes=1)
+        self.assertEqual(self.sync(encode_cursor(expired)).status_code, 410)
+
+    def test_membership_change_after_cursor_requires_reload(self):
+        cursor = self.sync().data["cursor"]
+        self.assertEqual(self.sync(cursor).status_code, 200)
+
+        other = Group.objects.get(name="other")
+        UserGroupRelation.objects.create(user=self.user, group=other)
+        self.assertEqual(self.sync(cursor).status_code, 410)
+
+        cursor = self.sync().data["cursor"]
+        # deleting the group removes the membership as well
+        other.delete()
+        self.assertEqual(self.sync(cursor).status_code, 410)
+
+
+class TaskListingTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.group = Group.objects.create(name="group")
+        UserGroupRelation.objects.create(user=self.user, group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.now = timezone.now()
+
+    def list_all(self, url, **params):
+        ids = []
+        response = self.client.get(url, {"page_size": 3, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [task["id"] for task in response.data["results"]]
+            if response.data["next"] is None:
+                return ids
+            response = self.client.get(response.data["next"])
+
+    def test_cursor_pages_across_equal_deadlines(self):
+        deadlines = [self.now] * 7 + [self.now - timedelta(hours=1), self.now + timedelta(hours=1)]
+        tasks = UserTask.objects.bulk_create([UserTask(name=f"task {n}", deadline=deadline, user=self.user) for n, deadline in enumerate(deadlines)])
+        UserTask.objects.create(name="foreign", deadline=self.now, user=create_user(1))
+
+        expected = [task.id for task in sorted(tasks, key=lambda task: (task.deadline, task.id))]
+        self.assertEqual(self.list_all("/api/tasks/"), expected)
+
+    def test_filters(self):
+        early = UserTask.objects.create(name="early", deadline=self.now - timedelta(days=1), user=self.user)
+        done = UserTask.objects.create(name="done", deadline=self.now, state=1, user=self.user)
+        late = UserTask.objects.create(name="late", deadline=self.now + timedelta(days=1), user=self.user)
+
+        self.assertEqual(self.list_all("/api/tasks/", state=1), [done.id])
+        self.assertEqual(self.list_all("/api/tasks/", deadline__gte=self.now.isoformat()), [done.id, late.id])
+        self.assertEqual(self.list_all("/api/tasks/", deadline__lte=self.now.isoformat()), [early.id, done.id])
+        self.assertEqual(self.list_all("/api/tasks/", state=0, deadline__gte=self.now.isoformat()), [late.id])
+
+    def test_bad_filter_value_is_rejected(self):
+        for params in ({"state": "done"}, {"deadline__gte": "tomorrow"}, {"deadline__lte": "2026-13-01"}):
+            self.assertEqual(self.client.get("/api/tasks/", params).status_code, 400, params)
+            self.assertEqual(self.client.get(f"/api/groups/{self.group.id}/tasks/", params).status_code, 400, params)
+
+    def test_group_listing(self):
+        tasks = GroupTask.objects.bulk_create([GroupTask(name=f"task {n}", deadline=self.now, state=n % 2, group=self.group) for n in range(5)])
+        GroupTask.objects.create(name="foreign", deadline=self.now, group=Group.objects.create(name="other"))
+
+        url = f"/api/groups/{self.group.id}/tasks/"
+        self.assertEqual(self.list_all(url), [task.id for task in tasks])
+        self.assertEqual(self.list_all(url, state=1), [task.id for task in tasks if task.state == 1])
+
+    def test_group_listing_requires_membership(self):
+        other = Group.objects.create(name="other")
+        self.assertEqual(self.client.get(f"/api/groups/{other.id}/tasks/").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/groups/{other.id + 1}/tasks/").status_code, 404)
+
+
+class TombstoneTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.group = Group.objects.create(name="group")
+        UserGroupRelation.objects.create(user=self.user, group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.deadline = timezone.now() + timedelta(days=1)
+
+    def create_tasks(self, count):
+        user_tasks = UserTask.objects.bulk_create([UserTask(name=f"task {n}", deadline=self.deadline, user=self.user) for n in range(count)])
+        group_tasks = GroupTask.objects.bulk_create([GroupTask(name=f"task {n}", deadline=self.deadline, group=self.group) for n in range(count)])
+        return [task.id for task in user_tasks], [task.id for task in group_tasks]
+
+    def tombstones(self, **owner):
+        return sorted(DeletedTask.objects.filter(**owner).values_list("task_id", flat=True))
+
+    def count_tombstone_inserts(self, delete):
+        with CaptureQueriesContext(connection) as queries:
+            delete()
+        return sum(query["sql"].startswith(f'INSERT INTO "{DeletedTask._meta.db_table}"') for query in queries)
+
+    def test_single_deletes_leave_a_tombstone(self):
+        [task_id], [group_task_id] = self.create_tasks(1)
+        self.assertEqual(self.client.delete(f"/api/tasks/{task_id}/").status_code, 204)
+        self.assertEqual(self.client.delete(f"/api/group-tasks/{group_task_id}/").status_code, 204)
+        self.assertEqual(self.tombstones(user_id=self.user.id), [task_id])
+        self.assertEqual(self.tombstones(group_id=self.group.id), [group_task_id])
+
+    def test_queryset_delete_writes_tombstones_in_bulk(self):
+        task_ids, _ = self.create_tasks(20)
+        self.assertEqual(self.count_tombstone_inserts(lambda: UserTask.objects.filter(user=self.user).delete()), 1)
+        self.assertEqual(self.tombstones(user_id=self.user.id), task_ids)
+
+    def test_owner_deletion_tombstones_tasks_in_one_insert(self):
+        task_ids, group_task_ids = self.create_tasks(200)
+        user_id, group_id = self.user.id, self.group.id
+        self.assertEqual(self.count_tombstone_inserts(self.group.delete), 1)
+        self.assertEqual(self.tombstones(group_id=group_id), group_task_ids)
+        self.assertEqual(self.count_tombstone_inserts(self.user.delete), 1)
+        self.assertEqual(self.tombstones(user_id=user_id), task_ids)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def assert_reads(self, status_code):
+        for url in ("/api/tasks/", "/api/sync/", "/api/groups/"):
+            self.assertEqual(self.client.get(url).status_code, status_code, url)
+
+    def test_safe_requests_skip_the_user_query(self):
+        # only the task listing itself
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get("/api/tasks/").status_code, 200)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assert_reads(200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assert_reads(401)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = True
+            self.user.save()
+        self.assert_reads(200)
+
+    def test_deleted_user_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assert_reads(401)
+
+    def test_unavailable_redis_falls_back_to_the_database(self):
+        # a bulk update sends no signal, so no marker is written
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assert_reads(200)
+
+        with mock.patch("api.authentication.get_redis", side_effect=redis.ConnectionError()), \
+                self.assertLogs("api.authentication", "WARNING"):
+            self.assert_reads(401)
+
+    def test_marker_expires_with_the_access_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        ttl = get_redis().ttl(revoked_key(self.user.id))
+        self.assertEqual(ttl, int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds()))
+
+    def test_online_users_checks_staff_rights_in_the_database(self):
+        self.assertEqual(self.client.get("/api/online/").status_code, 403)
+
+        # tokens issued before the change carry no staff claim
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        self.assertEqual(self.client.get("/api/online/").status_code, 200)
+
+
+class TokenUserCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.redis = fakeredis.aioredis.FakeRedis(server=use_fake_redis(self))
+        for target, value in [("api.middleware.get_async_redis", lambda: self.redis), ("api.middleware.token_user_cache", TokenUserCache(100, 300))]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = create_user(0)
+        self.user.is_staff = True
+        self.user.save()
+        self.token = str(AccessToken.for_user(self.user))
+
+    async def handshake(self):
+        scope = {"type": "websocket", "query_string": f"token={self.token}".encode()}
+
+        async def app(scope, receive, send):
+            self.scope_user = scope["user"]
+
+        await JWTAuthMiddleware(app)(scope, None, None)
+        return self.scope_user
+
+    async def test_repeated_handshakes_reuse_the_user(self):
+        first = await self.handshake()
+        self.assertIs(await self.handshake(), first)
+
+    async def test_change_through_another_worker_invalidates_the_entry(self):
+        self.assertTrue((await self.handshake()).is_staff)
+
+        # another worker's signal handler only reaches this one through Redis
+        await User.objects.filter(id=self.user.id).aupdate(is_staff=False)
+        await self.redis.incr(auth_version_key(self.user.id))
+        self.assertFalse((await self.handshake()).is_staff)
+
+        await User.objects.filter(id=self.user.id).adelete()
+        await self.redis.incr(auth_version_key(self.user.id))
+        self.assertFalse((await self.handshake()).is_authenticated)
+
+    def test_user_changes_bump_the_auth_version(self):
+        key = auth_version_key(self.user.id)
+        version = int(get_redis().get(key))
+        # outside a transaction the bump runs right away
+        self.user.save()
+        self.assertEqual(int(get_redis().get(key)), version + 1)
+
+
+class GroupDetailCacheTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        # TestCase never commits, so invalidations are run by hand
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = create_user(0)
+            self.group = Group.objects.create(name="group")
+            UserGroupRelation.objects.create(user=self.user, group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/groups/{self.group.id}/"
+
+    def create_task(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            GroupTask.objects.create(name=name, deadline=timezone.now() + timedelta(days=1), group=self.group)
+
+    def test_cache_hit_skips_the_database(self):
+        self.create_task("first")
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.data, response.data)
+
+    def test_cache_hit_still_checks_membership(self):
+        self.client.get(self.url)
+        outsider = APIClient()
+        outsider.force_authenticate(create_user(1))
+        with self.assertNumQueries(0):
+            self.assertEqual(outsider.get(self.url).status_code, 404)
+
+    def test_task_changes_invalidate_the_payload(self):
+        self.create_task("first")
+        self.client.get(self.url)
+
+        self.create_task("second")
+        response = self.client.get(self.url)
+        self.assertEqual([task["name"] for task in response.data["tasks"]], ["first", "second"])
+
+    def test_membership_changes_invalidate_the_payload(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserGroupRelation.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_invalidations_are_bumped_once_per_transaction(self):
+        other = Group.objects.create(name="other")
+        with self.captureOnCommitCallbacks() as callbacks:
+            for group in (self.group, other, self.group):
+                GroupTask.objects.create(name="task", deadline=timezone.now() + timedelta(days=1), group=group)
+        self.assertEqual([callback.group_ids for callback in callbacks], [{self.group.id, other.id}])
+
+    def test_rolled_back_savepoint_drops_its_invalidations(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    group_cache.invalidate(self.group.id)
+                    raise DatabaseError()
+            except DatabaseError:
+                pass
+            group_cache.invalidate(self.group.id + 1)
+        self.assertEqual([callback.group_ids for callback in callbacks], [{self.group.id + 1}])
+
+    def test_group_deletion_does_not_grow_with_task_count(self):
+        for tasks in (0, 200):
+            with self.captureOnCommitCallbacks(execute=True):
+                group = Group.objects.create(name=f"group with {tasks} tasks")
+                UserGroupRelation.objects.create(user=self.user, group=group)
+                GroupTask.objects.bulk_create([GroupTask(name="task", deadline=timezone.now(), group=group) for _ in range(tasks)])
+
+            group_id = group.id
+            # relations, tombstones, the task cascade, the member's groups_changed_at, relations, group
+            with self.assertNumQueries(6), self.captureOnCommitCallbacks(execute=True) as callbacks:
+                group.delete()
+            invalidations = [callback for callback in callbacks if isinstance(callback, group_cache.PendingInvalidation)]
+            self.assertEqual([callback.group_ids for callback in invalidations], [{group_id}])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DeadlineSchedulerTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.group = Group.objects.create(name="group")
+        self.now = timezone.now()
+
+    def test_tick_expires_due_tasks_only(self):
+        due = UserTask.objects.create(name="due", deadline=self.now - timedelta(minutes=1), user=self.user)
+        done = UserTask.objects.create(name="done", deadline=self.now - timedelta(minutes=1), state=1, user=self.user)
+        later = UserTask.objects.create(name="later", deadline=self.now + timedelta(hours=1), user=self.user)
+        version = User.objects.get(id=self.user.id).data_version
+
+        self.assertEqual(DeadlineScheduler().tick(self.now), 1)
+        self.assertEqual(
+            dict(UserTask.objects.values_list("id", "state")),
+            {due.id: 2, done.id: 1, later.id: 0}
+        )
+        self.assertEqual(User.objects.get(id=self.user.id).data_version, version + 1)
+
+    def test_moved_deadline_is_not_expired(self):
+        task = GroupTask.objects.create(name="moved", deadline=self.now + timedelta(seconds=30), group=self.group)
+        scheduler = DeadlineScheduler()
+        scheduler.refresh(self.now)
+
+        GroupTask.objects.filter(id=task.id).update(deadline=self.now + timedelta(days=1))
+        self.assertEqual(scheduler.tick(self.now + timedelta(seconds=45)), 0)
+        self.assertEqual(GroupTask.objects.get(id=task.id).state, 0)
+
+    def test_expired_group_tasks_are_broadcast_once_per_group(self):
+        tasks = [GroupTask.objects.create(name="due", deadline=self.now - timedelta(minutes=n), group=self.group) for n in (1, 2)]
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"group_{self.group.id}", channel)
+
+        with mock.patch.object(layer, "group_send", wraps=layer.group_send) as group_send:
+            DeadlineScheduler().tick(self.now)
+        self.assertEqual(group_send.call_count, 1)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event["type"], "group.tasks_expired")
+        self.assertEqual(sorted(event["task_ids"]), sorted(task.id for task in tasks))
+
+    def test_unavailable_channel_layer_does_not_stop_the_scheduler(self):
+        task = GroupTask.objects.create(name="due", deadline=self.now - timedelta(minutes=1), group=self.group)
+        layer = get_channel_layer()
+
+        with mock.patch.object(layer, "group_send", side_effect=redis.ConnectionError()), \
+                self.assertLogs("api.scheduler", "WARNING"):
+            self.assertEqual(DeadlineScheduler().tick(self.now), 1)
+        self.assertEqual(GroupTask.objects.get(id=task.id).state, 2)
+
+
+class SnapshotViewTests(TestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.user = create_user(0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_snapshot(self, etag=None):
+        # force_authenticate reuses the same instance, so refresh it the way authentication would load it
+        self.user.refresh_from_db()
+        return self.client.get("/api/snapshot/", headers={"If-None-Match": etag} if etag else {})
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get_snapshot()["ETag"]
+        response = self.get_snapshot(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_task_change_bumps_etag(self):
+        etag = self.get_snapshot()["ETag"]
+        UserTask.objects.create(name="new", deadline=timezone.now() + timedelta(days=1), user=self.user)
+
+        response = self.get_snapshot(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual([task["name"] for task in response.data["tasks"]], ["new"])
+
+    def test_deleting_tasks_bumps_etag_once(self):
+        UserTask.objects.bulk_create([UserTask(name=f"task {n}", deadline=timezone.now(), user=self.user) for n in range(3)])
+        version = User.objects.get(id=self.user.id).data_version
+
+        UserTask.objects.filter(user=self.user).delete()
+        self.assertEqual(User.objects.get(id=self.user.id).data_version, version + 1)
+        self.assertEqual(self.get_snapshot()["ETag"], f'"{self.user.id}-{version + 1}"')
+
+    def test_user_deletion_does_not_grow_with_task_count(self):
+        for tasks in (0, 200):
+            user = create_user(f"deleted-{tasks}")
+            UserTask.objects.bulk_create([UserTask(name="task", deadline=timezone.now(), user=user) for _ in range(tasks)])
+            # relations, tombstones, admin log, auth groups, permissions, the task cascade, user
+            with self.assertNumQueries(7):
+                user.delete()
+
+    def test_login_does_not_bump_etag(self):
+        etag = self.get_snapshot()["ETag"]
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=["last_login"])
+        self.assertEqual(self.get_snapshot(etag).status_code, 304)
 
-# Create your tests here.
@@ -8,12 +8,14 @@ group_viewset_router.register(r'groups', views.GroupViewSet, basename='group')
 urlpatterns = [
     path("register/", views.RegisterView.as_view(), name="register"),
     path("login/", views.LoginView.as_view(), name="login"),
+    path("snapshot/", views.SnapshotView.as_view(), name="snapshot"),
+    path("sync/", views.SyncView.as_view(), name="sync"),
     path("my-profile/", views.UserRUDView.as_view(), name="manage_user"),
-    path("tasks/", views.UserTaskCreateView.as_view(), name="create_user_task"),
+    path("tasks/", views.UserTaskListCreateView.as_view(), name="user_tasks"),
     path("tasks/<int:pk>/", views.UserTaskRUDView.as_view(), name="manage_user_task"),
     path("", include(group_viewset_router.urls)),
     path("groups/<int:group_id>/member/<int:user_id>/", views.GroupMembershipView.as_view(), name="manage_group_members"),
-    path("groups/<int:id>/tasks/", views.GroupTaskCreateView.as_view(), name="create_group_task"),
+    path("groups/<int:id>/tasks/", views.GroupTaskListCreateView.as_view(), name="group_tasks"),
     path("group-tasks/<int:pk>/", views.GroupTaskRUDView.as_view(), name="manage_group_tasks"),
     path("online/", views.OnlineUsersView.as_view(), name="online_users")
 ]
@@ -1,19 +1,58 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Prefetch, Q
 from django.shortcuts import get_object_or_404
-from django.contrib.auth import authenticate
-from rest_framework import generics, views, viewsets, serializers
+from django.utils import timezone
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import generics, views, viewsets
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import User, Group, UserTask, GroupTask, UserGroupRelation
-from .serializers import UserSerializer, GroupSerializer, UserTaskSerializer, GroupTaskSerializer, CustomTokenObtainPairSerializer, GroupDetailSerializer
+from .authentication import ClaimsJWTAuthentication
+from .filters import UserTaskFilter, GroupTaskFilter
+from . import group_cache
+from .models import User, Group, UserTask, GroupTask, UserGroupRelation, DeletedTask
+from .pagination import DeadlineCursorPagination
+from . import presence
+from .serializers import UserSerializer, GroupSerializer, UserTaskSerializer, GroupTaskSerializer, CustomTokenObtainPairSerializer, GroupDetailSerializer, LoginResponseSerializer
+
+
+def notify_group(group_id, event):
+    async_to_sync(get_channel_layer().group_send)(f"group_{group_id}", event)
+
+
+def build_snapshot(user):
+    return LoginResponseSerializer({
+        "user": user,
+        "groups": Group.objects.filter(group_users__user=user),
+        "tasks": user.tasks.all()
+    }).data
+
+
+def snapshot_etag(user):
+    return f'"{user.id}-{user.data_version}"'
+
+
+# rows committed while a sync query runs can carry an earlier updated_at, so cursors step back a little
+SYNC_CURSOR_OVERLAP = timedelta(seconds=5)
+
+
+def encode_cursor(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
 
-import redis
+def decode_cursor(cursor):
+    return datetime.fromtimestamp(int(cursor) / 1_000_000, tz=dt_timezone.utc)
 
-redis_db = redis.Redis(host='localhost', port=6379, db=0)
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -40,25 +79,83 @@ class LoginView(TokenObtainPairView):
     permission_classes = [AllowAny]
 
     def post(self, request, *args, **kwargs):
-        email = request.data.get("email")
-        password = request.data.get("password")
+        # the serializer checks the password exactly once and keeps the authenticated user
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
 
-        user = authenticate(email=email, password=password)
-        if not user:
-            raise serializers.ValidationError("Invalid email or password")
+        user = serializer.user
+        response = Response({**serializer.validated_data, **build_snapshot(user)}, status=200)
+        response["ETag"] = snapshot_etag(user)
 
-        response = super().post(request, *args, **kwargs)
+        return response
 
-        user_tasks = user.tasks.all()
-        user_groups = Group.objects.filter(group_users__user=user)
 
-        response.data.update({
-            "user": UserSerializer(user).data,
-            "groups": GroupSerializer(user_groups, many=True).data,
-            "tasks": UserTaskSerializer(user_tasks, many=True).data
-        })
+class SnapshotView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        return response
+    def get(self, request):
+        user = request.user
+        etag = snapshot_etag(user)
+
+        # the user row is already loaded by authentication, so a matching ETag costs no extra queries
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            return Response(status=304, headers={"ETag": etag})
+
+        return Response(build_snapshot(user), headers={"ETag": etag})
+
+
+class SyncView(APIView):
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        now = timezone.now()
+        cursor = request.query_params.get("since")
+
+        tasks = UserTask.objects.filter(user_id=user.id)
+        group_tasks = GroupTask.objects.filter(group__group_users__user_id=user.id)
+        deleted = DeletedTask.objects.none()
+
+        if cursor is not None:
+            try:
+                since = decode_cursor(cursor)
+            except (ValueError, OverflowError):
+                return Response({"detail": "Invalid cursor."}, status=400)
+
+            if since < now - settings.SYNC_TOMBSTONE_RETENTION:
+                return Response({"detail": "Cursor has expired, reload the snapshot."}, status=410)
+
+            # tasks of joined groups and deletions in left groups are not in the incremental diff.
+            # The cursor was issued SYNC_CURSOR_OVERLAP after since, and that response already had the memberships of that moment.
+            if User.objects.filter(id=user.id, groups_changed_at__gt=since + SYNC_CURSOR_OVERLAP).exists():
+                return Response({"detail": "Group membership has changed, reload the snapshot."}, status=410)
+
+            tasks = tasks.filter(updated_at__gt=since)
+            group_tasks = group_tasks.filter(updated_at__gt=since)
+            deleted = DeletedTask.objects.filter(
+                Q(user_id=user.id) | Q(group_id__in=UserGroupRelation.objects.filter(user_id=user.id).values("group_id")),
+                deleted_at__gt=since
+            )
+
+        deleted_tasks = []
+        deleted_group_tasks = []
+        for tombstone in deleted.only("task_id", "user_id"):
+            if tombstone.user_id is not None:
+                deleted_tasks.append(tombstone.task_id)
+            else:
+                deleted_group_tasks.append(tombstone.task_id)
+
+        return Response({
+            "cursor": encode_cursor(now - SYNC_CURSOR_OVERLAP),
+            "tasks": UserTaskSerializer(tasks, many=True).data,
+            "group_tasks": GroupTaskSerializer(group_tasks, many=True).data,
+            "deleted_tasks": deleted_tasks,
+            "deleted_group_tasks": deleted_group_tasks
+        })
 
 
 class UserRUDView(generics.RetrieveUpdateDestroyAPIView):
@@ -86,22 +183,58 @@ class UserRUDView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class GroupViewSet(viewsets.ModelViewSet):
+    authentication_classes = [ClaimsJWTAuthentication]
     serializer_class = GroupSerializer
     permission_classes = [AllowAny]
     lookup_field = "id"
 
     def get_queryset(self):
-        return Group.objects.filter(group_users__user=self.request.user)
+        queryset = Group.objects.filter(group_users__user_id=self.request.user.id)
+
+        if self.action == "list":
+            return queryset.only("id", "name")
+        if self.action == "retrieve":
+            return queryset.only("id", "name").prefetch_related(
+                Prefetch(
+                    "group_users",
+                    queryset=UserGroupRelation.objects.select_related("user").only(
+                        "group", *(f"user__{field}" for field in UserSerializer.Meta.fields if field != "password")
+                    )
+                ),
+                Prefetch(
+                    "tasks",
+                    queryset=GroupTask.objects.only(*GroupTaskSerializer.Meta.fields).order_by("deadline", "id")[:GroupDetailSerializer.task_limit + 1],
+                    to_attr="upcoming_tasks"
+                )
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "retrieve":
             return GroupDetailSerializer
         return GroupSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            group_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            raise NotFound()
+
+        # a cache miss runs the membership-filtered query, a hit checks the cached member list instead
+        data = group_cache.get_group_detail(group_id, lambda: self.get_serializer(self.get_object()).data)
+        if not any(member["id"] == request.user.id for member in data["members"]):
+            raise NotFound()
+        return Response(data)
+
     def perform_create(self, serializer):
         group = serializer.save()
         UserGroupRelation.objects.create(user=self.request.user, group=group)
 
+    def perform_destroy(self, instance):
+        group_id = instance.id
+        instance.delete()
+        notify_group(group_id, {"type": "group.deleted"})
+
 
 class GroupMembershipView(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -116,7 +249,9 @@ class GroupMembershipView(views.APIView):
         if UserGroupRelation.objects.filter(user=request.user, group=group).exists():
             return Response({"detail": "You are already a member of this group."}, status=400)
 
-        UserGroupRelation.objects.get_or_create(user=user, group=group)
+        _, created = UserGroupRelation.objects.get_or_create(user=user, group=group)
+        if created:
+            notify_group(group.id, {"type": "group.member_added", "user_id": user.id})
 
         return Response({
             "id": group.id,
@@ -133,13 +268,21 @@ class GroupMembershipView(views.APIView):
         relation = UserGroupRelation.objects.filter(user=user, group=group).first()
         if relation:
             relation.delete()
+            notify_group(group.id, {"type": "group.member_removed", "user_id": user.id})
             return Response({"detail": f"User {user.username} removed from group '{group.name}'."}, status=204)
         return Response({"detail": "User is not in the group."}, status=400)
 
 
-class UserTaskCreateView(generics.CreateAPIView):
+class UserTaskListCreateView(generics.ListCreateAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     serializer_class = UserTaskSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DeadlineCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = UserTaskFilter
+
+    def get_queryset(self):
+        return UserTask.objects.filter(user_id=self.request.user.id)
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -147,34 +290,45 @@ class UserTaskCreateView(generics.CreateAPIView):
 
 
 class UserTaskRUDView(generics.RetrieveUpdateDestroyAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     serializer_class = UserTaskSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return UserTask.objects.filter(user=self.request.user)
+        return UserTask.objects.filter(user_id=self.request.user.id)
 
 
-class GroupTaskCreateView(generics.CreateAPIView):
+class GroupTaskListCreateView(generics.ListCreateAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     serializer_class = GroupTaskSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DeadlineCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = GroupTaskFilter
 
-    def perform_create(self, serializer):
-        group_id = self.kwargs.get("id")
-        group = get_object_or_404(Group, id=group_id)
+    def get_group(self):
+        group = get_object_or_404(Group, id=self.kwargs.get("id"))
 
-        if not UserGroupRelation.objects.filter(user=self.request.user, group=group).exists():
-            return Response({"detail": "You are not a member of this group."}, status=403)
+        if not UserGroupRelation.objects.filter(user_id=self.request.user.id, group=group).exists():
+            raise PermissionDenied("You are not a member of this group.")
+
+        return group
 
-        serializer.save(group=group)
+    def get_queryset(self):
+        return GroupTask.objects.filter(group=self.get_group())
+
+    def perform_create(self, serializer):
+        serializer.save(group=self.get_group())
 
 
 class GroupTaskRUDView(generics.RetrieveUpdateDestroyAPIView):
+    authentication_classes = [ClaimsJWTAuthentication]
     serializer_class = GroupTaskSerializer
     permission_classes = [IsAuthenticated]
     queryset = GroupTask.objects.all()
 
     def get_queryset(self):
-        return GroupTask.objects.filter(group__group_users__user=self.request.user)
+        return GroupTask.objects.filter(group__group_users__user_id=self.request.user.id)
 
 
 class OnlineUsersView(APIView):
@@ -183,15 +337,18 @@ class OnlineUsersView(APIView):
         if not user.is_staff:
             return Response({"detail": "You are not an administrator."}, status=403)
 
-        online_users = []
-        for key in redis_db.scan_iter("u:*"):
-            user_id = key.decode().split(":")[1]
-            try:
-                user = User.objects.get(id=user_id)
-                online_users.append({
-                    "id": user.id,
-                    "username": user.username
-                })
-            except User.DoesNotExist:
-                pass
-        return Response(online_users, status=200)
\ No newline at end of file
+        try:
+            cursor = int(request.query_params.get("cursor", 0))
+            count = min(int(request.query_params.get("count", 100)), 1000)
+        except ValueError:
+            return Response({"detail": "cursor and count must be integers."}, status=400)
+        # HSCAN rejects these with a syntax error
+        if not 0 <= cursor < 2 ** 64 or count < 1:
+            return Response({"detail": "cursor must be a non-negative scan cursor and count a positive integer."}, status=400)
+
+        # usernames are kept next to the presence counters, so listing never touches the database
+        next_cursor, online_users = presence.online_users(cursor, count)
+        return Response({
+            "next": next_cursor or None,
+            "results": online_users
+        }, status=200)